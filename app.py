@@ -1,11 +1,24 @@
+import uuid
 import streamlit as st
 import pandas as pd
 import plotly.express as px
 from streamlit_gsheets import GSheetsConnection
 from datetime import datetime, timedelta, date
+from ledger import apply_payment, orphan_payments, kpi_cards, STATUS_LIST, FEES_FACTOR
+from sheets import coerce_frames, append_frame, apply_changes, row_hints, editor_delta, edited_before, DATE_COLS, CATEGORY_COLS
+from storage import open_store
+from perf import start_run, finish_run, finish_current, lap, frame, instrument
+from data_cache import SheetCache
+from write_queue import WriteQueue
+from orders_grid import filter_orders, page_of
+from bulk_import import plan_import, recheck_payments, commit_import, paid_patch
+from forecast import expand_obligations, bucket_obligations, MILESTONES
+from timeline import build_timeline, window_timeline, aggregate_by_supplier
+from archive import archive_candidates
 
 # --- 1. إعدادات الصفحة ---
 st.set_page_config(page_title="نظام إدارة المشتريات واللوجستيات", layout="wide", page_icon="🚢")
+perf_run = start_run()
 
 st.markdown("""
 <style>
@@ -33,79 +46,67 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
-# --- الثوابت ---
-STATUS_LIST = ["لم يبدأ", "تم الاعتماد", "جاري التجهيز", "تم الشحن", "تخليص جمركي", "وصلت للمستودع", "مسددة بالكامل"]
-FEES_FACTOR = 0.744
-
 # --- 2. الاتصال والبيانات ---
-conn = st.connection("gsheets", type=GSheetsConnection)
+# مصدر البيانات من secrets: [storage] backend = "gsheets" (الافتراضي) أو "sqlite"
+@st.cache_resource
+def get_store():
+    try: settings = st.secrets.get("storage", {})
+    except Exception: settings = {}
+    return open_store(settings, lambda: st.connection("gsheets", type=GSheetsConnection))
+
+@st.cache_resource
+def get_write_queue():
+    # طابور كتابة واحد لكل المستخدمين: الحفظ يعود فوراً والأرقام تحجز بدون تداخل
+    return WriteQueue(store)
+
+@st.cache_resource
+def get_sheet_cache():
+    # كاش مشترك بين الجلسات: يقدم آخر نسخة سليمة ويحدثها في الخلفية (بعد وصول الكتابات المعلقة)
+    cache = SheetCache(write_queue.load)
+    store.cache = cache
+    return cache
+
+def rerun():
+    # دورات الحفظ تنتهي بـ st.rerun (وهي الأبطأ): تسجل قياسها قبل القطع
+    finish_current()
+    st.rerun()
+
+store = get_store()
+write_queue = get_write_queue()
+sheet_cache = get_sheet_cache()
+session_id = st.session_state.setdefault("session_id", uuid.uuid4().hex)
 
 def load_data():
+    # نفس الإطارات المخزنة بدون نسخ (للقراءة) — من يعدل ينسخ بنفسه
     try:
-        df_orders = conn.read(worksheet="Sheet1", ttl=0)
-        try:
-            df_payments = conn.read(worksheet="payments", ttl=0)
-        except:
-            df_payments = pd.DataFrame() 
-
-        # إصلاح الهمزة
-        df_orders.rename(columns=lambda x: x.replace('إجمالي', 'اجمالي'), inplace=True)
-
-        ord_cols = [
-            "ID", "الطلبية", "المورد", "القيمة_دولار", "سعر_الصرف", 
-            "قيمة_البضاعة_ريال", "رسوم_شحن_تخليص", "اجمالي_التكلفة", 
-            "المدفوع", "المتبقي", "الحالة", "ملاحظات",
-            "نسبة_اعتماد", "نسبة_شحن", "نسبة_وصول",
-            "تاريخ_الاعتماد_الفعلي", "تاريخ_الشحن_المتوقع", 
-            "تاريخ_الشحن_الفعلي", "تاريخ_الوصول_المتوقع", "تاريخ_الوصول_الفعلي"
-        ]
-        
-        if df_orders.empty: df_orders = pd.DataFrame(columns=ord_cols)
-        else:
-            for col in ord_cols:
-                if col not in df_orders.columns: df_orders[col] = None
-            
-        pay_cols = ["PaymentID", "OrderID", "التاريخ", "المبلغ", "البيان", "رابط_السند"]
-        if df_payments.empty: df_payments = pd.DataFrame(columns=pay_cols)
-        for col in pay_cols:
-            if col not in df_payments.columns: df_payments[col] = None
-
-        num_cols = ["القيمة_دولار", "سعر_الصرف", "قيمة_البضاعة_ريال", "رسوم_شحن_تخليص", "اجمالي_التكلفة", "المدفوع", "المتبقي", "نسبة_اعتماد", "نسبة_شحن", "نسبة_وصول"]
-        for col in num_cols: 
-            if col in df_orders.columns:
-                df_orders[col] = pd.to_numeric(df_orders[col], errors='coerce').fillna(0)
-        
-        df_orders['ID'] = pd.to_numeric(df_orders['ID'], errors='coerce').fillna(0).astype(int)
-        df_payments['PaymentID'] = pd.to_numeric(df_payments['PaymentID'], errors='coerce').fillna(0).astype(int)
-        df_payments['OrderID'] = pd.to_numeric(df_payments['OrderID'], errors='coerce').fillna(0).astype(int)
-        df_payments['المبلغ'] = pd.to_numeric(df_payments['المبلغ'], errors='coerce').fillna(0)
-
-        date_cols = ["تاريخ_الاعتماد_الفعلي", "تاريخ_الشحن_المتوقع", "تاريخ_الشحن_الفعلي", "تاريخ_الوصول_المتوقع", "تاريخ_الوصول_الفعلي"]
-        for col in date_cols: 
-            if col in df_orders.columns:
-                df_orders[col] = pd.to_datetime(df_orders[col], errors='coerce')
-        
-        if not df_payments.empty:
-            real_paid = df_payments.groupby('OrderID')['المبلغ'].sum().reset_index()
-            for index, row in df_orders.iterrows():
-                oid = row['ID']
-                paid_amt = real_paid[real_paid['OrderID'] == oid]['المبلغ'].sum()
-                df_orders.at[index, 'المدفوع'] = paid_amt
-                if 'اجمالي_التكلفة' in row:
-                    df_orders.at[index, 'المتبقي'] = row['اجمالي_التكلفة'] - paid_amt 
-
-        df_orders['المتبقي'] = df_orders['اجمالي_التكلفة'] - df_orders['المدفوع']
-
-        return df_orders, df_payments
+        return sheet_cache.get(copy=False)
     except Exception as e:
         st.error(f"خطأ في التحميل: {e}")
         return pd.DataFrame(), pd.DataFrame()
 
 df_orders, df_payments = load_data()
+df_orphans = orphan_payments(df_orders, df_payments)
+lap("load", rows=len(df_orders) + len(df_payments))
 
 # --- 3. الواجهة الرئيسية ---
 st.title("🚢 نظام إدارة المشتريات (سجل الدفعات)")
 
+if sheet_cache.last_error is not None:
+    st.caption(f"⚠️ تعذر تحديث البيانات من المصدر، المعروض آخر نسخة محفوظة ({sheet_cache.last_error})")
+
+# نتائج الحفظ في الخلفية لهذا المستخدم (تعارض مع مستخدم آخر / فشل بعد إعادة المحاولة)
+for notice in write_queue.take_notices(session_id):
+    st.warning(f"⚠️ {notice['message']}")
+if write_queue.pending():
+    st.caption(f"⏳ {write_queue.pending()} عملية حفظ قيد الإرسال...")
+
+if store.issues is not None and not store.issues.empty:
+    with st.expander(f"⚠️ {len(store.issues)} خلية غير صالحة في الأوراق (عوملت كـ 0 أو بدون تاريخ)"):
+        st.dataframe(store.issues, use_container_width=True, hide_index=True)
+
+if not df_orphans.empty:
+    st.warning(f"⚠️ توجد {len(df_orphans)} دفعة مرتبطة برقم طلبية غير موجود: {sorted(df_orphans['OrderID'].unique().tolist())}")
+
 with st.sidebar:
     st.header("📝 تسجيل طلبية جديدة")
     with st.form("add_order_form"):
@@ -134,10 +135,7 @@ with st.sidebar:
         submitted = st.form_submit_button("💾 حفظ الطلبية")
         if submitted:
             if order_name and val_usd > 0:
-                new_id = 1
-                if not df_orders.empty and len(df_orders) > 0:
-                    try: new_id = int(df_orders['ID'].max()) + 1
-                    except: new_id = 1
+                new_id = write_queue.reserve_ids("orders")
                 
                 today = datetime.now()
                 d_arrive_exp = str(target_arrival)
@@ -155,32 +153,76 @@ with st.sidebar:
                     "تاريخ_الاعتماد_الفعلي": d_conf, "تاريخ_الشحن_المتوقع": d_ship_exp,
                     "تاريخ_الشحن_الفعلي": None, "تاريخ_الوصول_المتوقع": d_arrive_exp, "تاريخ_الوصول_الفعلي": None
                 }])
-                updated_df = pd.concat([df_orders, new_row], ignore_index=True)
-                conn.update(worksheet="Sheet1", data=updated_df)
-                st.success("تمت الإضافة!"); st.cache_data.clear(); st.rerun()
+                # إضافة صف واحد فقط بدلاً من إعادة كتابة الورقة (في الخلفية)
+                write_queue.append("orders", new_row, origin=session_id)
+                # نفس الصف في الكاش والملخص بدون إعادة تحميل
+                new_row, _ = coerce_frames(new_row, pd.DataFrame())
+                sheet_cache.put((append_frame(df_orders, new_row), df_payments),
+                                update={"summary": lambda summary: summary.add(new_row.iloc[0])})
+                st.success("تمت الإضافة!"); rerun()
+
+    # --- استيراد جماعي من ملف: معاينة + تقرير أخطاء لكل صف ثم حفظ على دفعات ---
+    with st.expander("📥 استيراد من ملف (Excel / CSV)"):
+        import_table = st.radio("نوع البيانات", ["orders", "payments"], format_func={"orders": "طلبيات", "payments": "دفعات"}.get, horizontal=True, key="import_table")
+        upload = st.file_uploader("الملف", type=["xlsx", "csv"], key="import_file")
+        if upload is not None:
+            # نفس الملف لا يعاد تحليله في كل إعادة تشغيل؛ أرقام الطلبات يعاد التحقق منها عند الحفظ
+            plan_key = (upload.file_id, import_table)
+            if st.session_state.get("import_plan_key") != plan_key:
+                upload.seek(0)
+                st.session_state["import_plan"] = plan_import(upload, upload.name, import_table, FEES_FACTOR, df_orders['ID'])
+                st.session_state["import_plan_key"] = plan_key
+            import_rows, import_errors = st.session_state["import_plan"]
+
+            st.caption(f"✅ {len(import_rows)} صف صالح — ❌ {import_errors['الصف'].nunique()} صف مرفوض")
+            # المعاينة بدون أرقام: تُحجز عند الحفظ
+            st.dataframe(import_rows.head(20).drop(columns=["ID", "PaymentID"], errors="ignore"), use_container_width=True, hide_index=True)
+            if not import_errors.empty:
+                st.dataframe(import_errors, use_container_width=True, hide_index=True)
+                st.download_button("⬇️ تقرير الأخطاء", import_errors.to_csv(index=False).encode("utf-8-sig"), "import_errors.csv", "text/csv")
+
+            if st.button(f"💾 استيراد {len(import_rows)} صف", disabled=import_rows.empty):
+                skipped = 0
+                if import_table == "payments":
+                    import_rows, late_errors = recheck_payments(import_rows, df_orders['ID'])
+                    skipped = len(late_errors)
+                saved = commit_import(write_queue, import_table, import_rows, progress=st.progress(0.0).progress)
+                if import_table == "payments":
+                    # المدفوع/المتبقي للطلبات التي وصلتها الدفعات فقط
+                    changes = paid_patch(df_orders, pd.concat([df_payments, saved]), saved['OrderID'].unique())
+                    write_queue.patch("orders", changes, hints=row_hints(df_orders), origin=session_id)
+                # إعادة القراءة تنتظر وصول الدفعات للمصدر
+                sheet_cache.invalidate()
+                st.session_state.pop("import_plan_key", None)
+                st.success(f"تم استيراد {len(saved)} صف" + (f" (تخطي {skipped} دفعة لطلبات لم تعد موجودة)" if skipped else "")); rerun()
+
+    # --- الأرشيف: نقل الطلبات المسددة بالكامل ودفعاتها خارج البيانات النشطة ---
+    with st.expander("📦 أرشفة الطلبات المسددة"):
+        arc_days = st.number_input("وصلت قبل (يوم) على الأقل", min_value=0, value=30, step=30, key="arc_days")
+        arc_ids = archive_candidates(df_orders, date.today(), arc_days) if not df_orders.empty else []
+        st.caption(f"{len(arc_ids)} طلبية مسددة بالكامل جاهزة للأرشفة (تبقى في مجاميع الكروت وتعرض من قسم الأرشيف)")
+        if st.button(f"📦 أرشفة {len(arc_ids)} طلبية", disabled=not arc_ids):
+            # التعديلات المعلقة تصل للمصدر أولاً، ثم النقل مباشرة وإعادة القراءة
+            write_queue.flush(timeout=60)
+            moved = store.archive(df_orders, df_payments, arc_ids)
+            sheet_cache.invalidate()
+            st.success(f"تمت أرشفة {moved} طلبية"); rerun()
+
+lap("sidebar")
 
 # --- 4. الكروت العلوية (محدثة: التركيز على الالتزام القائم) ---
-if not df_orders.empty:
-    # 1. تحديد "الطلبات الجارية" (التي بدأت ولم تنتهِ مالياً)
-    # الشرط: الحالة ليست "لم يبدأ" وليست "مسددة بالكامل"
-    df_active_liability = df_orders[~df_orders['الحالة'].isin(["لم يبدأ", "مسددة بالكامل"])]
-    
-    # 2. الحسابات المالية (بناءً على الجارية فقط) - تمثل الالتزام الحالي
-    liability_total = df_active_liability['اجمالي_التكلفة'].sum() # قيمة البضاعة التي التزمت بها
-    liability_paid = df_active_liability['المدفوع'].sum()         # ما دفعته لهذه الالتزامات
-    liability_rem = df_active_liability['المتبقي'].sum()          # المتبقي واجب السداد
-    
-    # 3. حسابات العدد
-    cnt_active = len(df_active_liability) # عدد الطلبات الجارية
-    cnt_completed_final = len(df_orders[df_orders['الحالة'] == "مسددة بالكامل"])
-    cnt_shipped = len(df_orders[df_orders['الحالة'] == "تم الشحن"])
-    cnt_customs = len(df_orders[df_orders['الحالة'] == "تخليص جمركي"])
-    
-    # 4. مستهدف السنة (للعلم فقط - يشمل كل شيء)
-    target_year_total = df_orders['اجمالي_التكلفة'].sum()
-else:
-    liability_total = 0; liability_paid = 0; liability_rem = 0; target_year_total = 0
-    cnt_active = 0; cnt_completed_final = 0; cnt_shipped = 0; cnt_customs = 0
+# ملخص لكل حالة (العدد/الإجمالي/المدفوع/المتبقي) كاستعلام تجميعي واحد من طبقة التخزين
+# الطلبات الجارية = الحالة ليست "لم يبدأ" وليست "مسددة بالكامل"
+# مستهدف السنة (للعلم فقط - يشمل كل شيء، والمؤرشف من مجاميعه السنوية المحفوظة)
+kpi = kpi_cards(store.status_totals(), store.archive_totals())
+cnt_active = kpi["cnt_active"]
+liability_total = kpi["liability_total"]     # قيمة البضاعة التي التزمت بها
+liability_paid = kpi["liability_paid"]       # ما دفعته لهذه الالتزامات
+liability_rem = kpi["liability_rem"]         # المتبقي واجب السداد
+cnt_completed_final = kpi["cnt_completed_final"]
+cnt_shipped = kpi["cnt_shipped"]
+cnt_customs = kpi["cnt_customs"]
+target_year_total = kpi["target_year_total"]
 
 # --- الصف الأول: لوحة القيادة للالتزامات الحالية (الأهم) ---
 # هنا وضعنا عدد الجارية وبجانبه تفاصيلها المالية كما طلبت
@@ -207,55 +249,55 @@ s2.markdown(f'<div class="metric-card"><div class="metric-title">مستهدف م
 s3.markdown(f'<div class="metric-card"><div class="metric-title">في البحر/الجو</div><div class="metric-value">{cnt_shipped}</div></div>', unsafe_allow_html=True)
 s4.markdown(f'<div class="metric-card"><div class="metric-title">في الجمارك</div><div class="metric-value">{cnt_customs}</div></div>', unsafe_allow_html=True)
 
+# --- تفصيل الملخص حسب المورد والشهر (من نفس الخلايا المجمعة) ---
+with st.expander("📊 تفصيل حسب المورد / الشهر"):
+    summary = store.summary()
+    k1, k2 = st.columns(2)
+    k1.dataframe(summary.by_supplier().sort_values("remaining", ascending=False), use_container_width=True)
+    k2.dataframe(summary.by_month().sort_index(ascending=False), use_container_width=True)
+
+lap("kpi")
+
 # --- 5. الجدول الزمني (المحسن) ---
 
-st.subheader("🗓️ الجدول الزمني للطلبات")
-if not df_orders.empty:
-    timeline_data = []
-    today = datetime.now()
-    # عنصر وهمي لضبط المقياس
-    timeline_data.append(dict(Task="-- Scale --", Start=today, Finish=today + timedelta(days=365), Stage="Scale", Color="rgba(0,0,0,0)"))
-
-    for _, row in df_orders.iterrows():
-        if row['الحالة'] == "لم يبدأ":
-            arrive_exp = row['تاريخ_الوصول_المتوقع']
-            if pd.isna(arrive_exp): arrive_exp = today + timedelta(days=60)
-            start_plan = arrive_exp - timedelta(days=60)
-            timeline_data.append(dict(Task=row['الطلبية'], Start=start_plan, Finish=arrive_exp, Stage="مخطط (60 يوم)", Color="#95a5a6"))
-        elif row['الحالة'] in ["وصلت للمستودع", "مسددة بالكامل"]:
-            start_actual = row['تاريخ_الاعتماد_الفعلي']
-            end_actual = row['تاريخ_الوصول_الفعلي']
-            if pd.isna(start_actual): start_actual = today
-            if pd.isna(end_actual): end_actual = today
-            timeline_data.append(dict(Task=row['الطلبية'], Start=start_actual, Finish=end_actual, Stage="مكتملة", Color="#27ae60"))
+@st.fragment
+@instrument("timeline")
+def timeline_panel():
+    # يعاد تشغيله وحده عند تغيير الفلاتر أو الصفحة
+    df_orders, _ = load_data()
+    st.subheader("🗓️ الجدول الزمني للطلبات")
+    if not df_orders.empty:
+        today = datetime.combine(date.today(), datetime.min.time())
+        # كل المراحل لكل الطلبات بعمليات على الأعمدة (مرة لكل نسخة بيانات ويوم)، ثم نعرض نافذة محدودة فقط
+        df_gantt = sheet_cache.derived(f"gantt:{today:%Y-%m-%d}", lambda df_orders, df_payments: build_timeline(df_orders, today))
+
+        t1, t2, t3, t4 = st.columns([2, 2, 1, 1])
+        tl_range = t1.date_input("الفترة", value=(today - timedelta(days=30), today + timedelta(days=300)), key="tl_range")
+        tl_status = t2.multiselect("الحالة", STATUS_LIST, key="tl_status")
+        tl_by_supplier = t3.toggle("تجميع حسب المورد", key="tl_by_supplier")
+        tl_page_size = t4.selectbox("عدد الطلبات", [25, 50, 100], key="tl_page_size")
+
+        tl_start, tl_end = (tl_range + (None,))[:2] if isinstance(tl_range, tuple) else (tl_range, None)
+        if tl_by_supplier:
+            df_clean, _ = window_timeline(df_gantt, tl_start, tl_end, tl_status)
+            df_clean = aggregate_by_supplier(df_clean)
         else:
-            start_conf = row['تاريخ_الاعتماد_الفعلي']
-            if pd.isna(start_conf): start_conf = today
-            date_ship = row['تاريخ_الشحن_الفعلي']
-            date_ship_exp = row['تاريخ_الشحن_المتوقع']
-            phase1_end = date_ship if pd.notna(date_ship) else (date_ship_exp if pd.notna(date_ship_exp) else start_conf + timedelta(days=30))
-            timeline_data.append(dict(Task=row['الطلبية'], Start=start_conf, Finish=phase1_end, Stage="تجهيز (30 يوم)", Color="#3498db"))
-            if row['الحالة'] in ["تم الشحن", "تخليص جمركي"]:
-                arrive_exp = row['تاريخ_الوصول_المتوقع']
-                calc_arrival = date_ship + timedelta(days=30) if pd.notna(date_ship) else phase1_end + timedelta(days=30)
-                phase2_end = arrive_exp if pd.notna(arrive_exp) else calc_arrival
-                color_phase2 = "#e67e22" if row['الحالة'] == "تم الشحن" else "#e74c3c"
-                stage_label = "شحن (30 يوم)" if row['الحالة'] != "تخليص جمركي" else "جمارك"
-                timeline_data.append(dict(Task=row['الطلبية'], Start=phase1_end, Finish=phase2_end, Stage=stage_label, Color=color_phase2))
-
-    if len(timeline_data) > 0:
-        df_gantt = pd.DataFrame(timeline_data)
-        df_clean = df_gantt[df_gantt['Task'] != "-- Scale --"]
+            _, tl_total = window_timeline(df_gantt, tl_start, tl_end, tl_status)
+            tl_pages = max(1, -(-tl_total // tl_page_size))
+            tl_page = st.number_input(f"الصفحة (من {tl_pages}) — {tl_total} طلبية", min_value=1, max_value=tl_pages, value=1, key="tl_page") if tl_pages > 1 else 1
+            df_clean, _ = window_timeline(df_gantt, tl_start, tl_end, tl_status, page=tl_page - 1, page_size=tl_page_size)
+
+        frame("timeline", df_clean)
         if not df_clean.empty:
             fig = px.timeline(
                 df_clean, x_start="Start", x_end="Finish", y="Task", color="Color",
                 title="", color_discrete_map="identity",
-                height=350 + (len(df_orders)*40), template="plotly_dark"
+                height=350 + (df_clean['Task'].nunique()*40), template="plotly_dark"
             )
             # تحديثات الشبكة (Grid Lines)
             fig.update_xaxes(
                 tickformat="%b %Y", dtick="M1", ticklabelmode="period", 
-                range=[today - timedelta(days=30), today + timedelta(days=300)], side="top",
+                range=[tl_start or today - timedelta(days=30), tl_end or today + timedelta(days=300)], side="top",
                 showgrid=True, gridwidth=1, gridcolor='#444444' # خطوط رأسية للأشهر
             )
             fig.update_yaxes(
@@ -270,13 +312,91 @@ if not df_orders.empty:
             )
             st.plotly_chart(fig, use_container_width=True)
 
+timeline_panel()
+
+# --- توقع الاحتياج النقدي (من نسب الدفع لكل مرحلة) ---
+@st.fragment
+@instrument("forecast")
+def forecast_panel():
+    df_orders, _ = load_data()
+    st.subheader("💵 توقع الاحتياج النقدي")
+    if df_orders.empty:
+        return
+    f1, f2, f3, f4 = st.columns(4)
+    fc_freq = f1.radio("التجميع", ["M", "W"], format_func={"M": "شهري", "W": "أسبوعي"}.get, horizontal=True, key="fc_freq")
+    fc_months = f2.selectbox("المدى (أشهر)", [3, 6, 12, 24], index=2, key="fc_months")
+    fc_delay = f3.number_input("تأخير المواعيد المتوقعة (يوم)", value=0, step=7, key="fc_delay")
+    fc_rate = f4.number_input("تغير سعر الصرف %", value=0.0, step=0.5, key="fc_rate")
+
+    today = date.today()
+    # المستحقات لكل الطلبات تحسب مرة لكل نسخة بيانات وسيناريو، والتجميع حسب الفترة من نفس النتيجة
+    obligations = sheet_cache.derived(
+        f"forecast:{today}:{fc_delay}:{fc_rate}",
+        lambda df_orders, df_payments: expand_obligations(df_orders, today, fc_delay, fc_rate / 100),
+    )
+    df_fc = bucket_obligations(obligations, fc_freq, horizon=pd.Timestamp(today) + pd.DateOffset(months=fc_months))
+    frame("forecast", df_fc)
+    if df_fc.empty:
+        st.info("لا توجد مستحقات مفتوحة.")
+        return
+
+    overdue = obligations.loc[obligations['متأخرة'], 'المبلغ'].sum()
+    st.caption(f"إجمالي المستحق في المدى: {df_fc['الإجمالي'].sum():,.0f} ريال — منها متأخر (مستحق الآن): {overdue:,.0f} ريال")
+    fig = px.bar(df_fc, x="الفترة", y=MILESTONES, template="plotly_dark", height=350,
+                 color_discrete_sequence=["#3498db", "#e67e22", "#27ae60"])
+    fig.add_scatter(x=df_fc["الفترة"], y=df_fc["التراكمي"], name="التراكمي", mode="lines+markers", line=dict(color="#e74c3c"))
+    fig.update_layout(barmode="stack", legend_title="", yaxis_title="ريال", xaxis_title="",
+                      margin=dict(l=10, r=10, t=30, b=10), paper_bgcolor='rgba(0,0,0,0)', plot_bgcolor='rgba(0,0,0,0)')
+    st.plotly_chart(fig, use_container_width=True)
+    st.dataframe(df_fc.style.format({c: "{:,.0f}" for c in MILESTONES + ["الإجمالي", "التراكمي"]} | {"الفترة": "{:%Y-%m-%d}"}),
+                 use_container_width=True, hide_index=True)
+
+forecast_panel()
+
+# --- الأرشيف (يقرأ عند الطلب فقط) ---
+@st.fragment
+@instrument("archive")
+def archive_panel():
+    with st.expander("🗄️ الأرشيف (الطلبات المسددة المنقولة)"):
+        arc_totals = store.archive_totals()
+        if arc_totals.empty:
+            st.caption("لا توجد طلبات مؤرشفة.")
+            return
+        st.dataframe(arc_totals.rename(columns={"count": "العدد", "total": "الإجمالي", "paid": "المدفوع"}).sort_values("السنة", ascending=False),
+                     use_container_width=True, hide_index=True)
+        if not st.toggle("عرض الطلبات المؤرشفة", key="arc_show"):
+            return
+        arc_orders, arc_payments = sheet_cache.derived("archive", lambda df_orders, df_payments: store.load_archive())
+        a1, a2, a3 = st.columns(3)
+        arc_text = a1.text_input("🔍 بحث في الطلبية", key="arc_text")
+        arc_supplier = a2.multiselect("المورد", sorted(arc_orders['المورد'].dropna().unique()), key="arc_supplier")
+        arc_range = a3.date_input("الوصول المتوقع", value=(), key="arc_range")
+        arc_start, arc_end = (tuple(arc_range) + (None, None))[:2]
+        arc_view = filter_orders(arc_orders, None, arc_supplier, arc_start, arc_end, arc_text)
+        arc_page, arc_pages = page_of(arc_view, st.session_state.get("arc_page", 1), 50)
+        if st.session_state.get("arc_page", 1) > arc_pages: st.session_state["arc_page"] = arc_pages
+        if arc_pages > 1:
+            st.number_input(f"الصفحة (من {arc_pages}) — {len(arc_view)} طلبية", min_value=1, max_value=arc_pages, key="arc_page")
+        st.dataframe(frame("archive_orders", arc_page), use_container_width=True, hide_index=True)
+        if not arc_payments.empty:
+            st.markdown("🔹 **دفعات الطلبات المعروضة:**")
+            st.dataframe(arc_payments[arc_payments['OrderID'].isin(arc_page['ID'])], use_container_width=True, hide_index=True)
+
+archive_panel()
+
 st.divider()
 
 # --- 6. منطقة العمل ---
 c_left, c_right = st.columns([1.8, 1])
 
-with c_left:
+@st.fragment
+@instrument("editor")
+def orders_editor():
+    # تعديل الخلايا يعيد تشغيل المحرر وحده
+    df_orders, _ = load_data()
     st.subheader("📋 سجل البيانات التفصيلي")
+    if df_orders.columns.empty:
+        return   # تعذر التحميل (الخطأ معروض أعلى الصفحة)
     col_config = {
         "ID": st.column_config.NumberColumn("#", width="small", disabled=True),
         "الطلبية": st.column_config.TextColumn(width="medium"),
@@ -286,98 +406,150 @@ with c_left:
         "الحالة": st.column_config.SelectboxColumn(options=STATUS_LIST),
         "المتبقي": st.column_config.NumberColumn(format="%.0f", disabled=True),
     }
-    
-    edited_df = st.data_editor(df_orders, num_rows="dynamic", use_container_width=True, column_config=col_config, key="main_editor")
-    
+
+    # فلترة وصفحات على الخادم: المحرر يستقبل الصفحة الظاهرة فقط
+    g1, g2, g3, g4 = st.columns([2, 2, 2, 2])
+    grid_text = g1.text_input("🔍 بحث في الطلبية", key="grid_text")
+    grid_status = g2.multiselect("الحالة", STATUS_LIST, key="grid_status")
+    grid_supplier = g3.multiselect("المورد", sorted(df_orders['المورد'].dropna().unique()), key="grid_supplier")
+    grid_range = g4.date_input("الوصول المتوقع", value=(), key="grid_range")
+    grid_start, grid_end = (tuple(grid_range) + (None, None))[:2]
+
+    df_view = filter_orders(df_orders, grid_status, grid_supplier, grid_start, grid_end, grid_text)
+    p1, p2 = st.columns([1, 3])
+    grid_page_size = p1.selectbox("صفوف الصفحة", [25, 50, 100, 250], index=1, key="grid_page_size")
+    df_page, grid_pages = page_of(df_view, st.session_state.get("grid_page", 1), grid_page_size)
+    if st.session_state.get("grid_page", 1) > grid_pages: st.session_state["grid_page"] = grid_pages
+    grid_page = p2.number_input(f"الصفحة (من {grid_pages}) — {len(df_view)} طلبية", min_value=1, max_value=grid_pages, key="grid_page") if grid_pages > 1 else 1
+
+    # مفتاح المحرر يتبع الصفحة والفلاتر حتى لا تنطبق تعديلات صفحة على أخرى
+    # الحالة/المورد فئوية في الذاكرة؛ في المحرر نصوص حتى يمكن كتابة مورد جديد
+    df_page = df_page.astype({c: object for c in CATEGORY_COLS})
+
+    editor_key = f"main_editor:{grid_page}:{grid_page_size}:{hash((grid_text, tuple(grid_status), tuple(grid_supplier), grid_start, grid_end))}"
+    edited_df = st.data_editor(frame("main_editor", df_page), num_rows="dynamic", use_container_width=True, column_config=col_config, key=editor_key)
+
     if st.button("💾 حفظ التعديلات"):
-        edited_df['قيمة_البضاعة_ريال'] = edited_df['القيمة_دولار'] * edited_df['سعر_الصرف']
-        edited_df['رسوم_شحن_تخليص'] = edited_df['القيمة_دولار'] * FEES_FACTOR
-        edited_df['اجمالي_التكلفة'] = edited_df['قيمة_البضاعة_ريال'] + edited_df['رسوم_شحن_تخليص']
-        edited_df['المتبقي'] = edited_df['اجمالي_التكلفة'] - edited_df['المدفوع']
-        conn.update(worksheet="Sheet1", data=edited_df)
+        # نرسل الخلايا المعدلة فقط (بالـ ID) ونضيف/نحذف الصفوف المتغيرة
+        editor_state = st.session_state.get(editor_key, {})
+        n_added = len(editor_state.get("added_rows", []))
+        changes, added, deleted = editor_delta(df_page, editor_state, FEES_FACTOR, write_queue.reserve_ids("orders", n_added) if n_added else None)
+        hints = row_hints(df_page)
+        # القيم التي رآها المستخدم قبل التعديل: إن غيرها غيره في المصدر يظهر تعارض بدلاً من الكتابة فوقها
+        write_queue.patch("orders", changes, expected=edited_before(df_page, editor_state), hints=hints, origin=session_id)
+        write_queue.append("orders", added, origin=session_id)
+        write_queue.delete("orders", deleted, hints=hints, origin=session_id)
+        sheet_cache.put((apply_changes(df_orders, changes, coerce_frames(added, pd.DataFrame())[0], deleted), df_payments))
         st.success("تم التحديث!")
-        st.cache_data.clear(); st.rerun()
+        rerun()
 
-with c_right:
+with c_left:
+    orders_editor()
+
+@st.fragment
+@instrument("payments_panel")
+def payments_panel():
+    # اختيار طلبية أخرى يعيد تشغيل هذا الجزء وحده من الكاش (بدون اتصال بالشبكة)
+    df_orders, df_payments = load_data()
     st.subheader("💳 إدارة الدفعات (سجل تاريخي)")
-    
+
     if not df_orders.empty:
-        df_orders['ID_str'] = df_orders['ID'].astype(str)
-        order_options = df_orders['ID_str'] + " - " + df_orders['الطلبية']
+        order_options = df_orders['ID'].astype(str) + " - " + df_orders['الطلبية']
         selected_option = st.selectbox("تحديد الطلبية:", order_options)
-        
+
         if selected_option:
             try: selected_id = int(float(selected_option.split(" - ")[0]))
-            except: st.stop()
+            except: finish_current(); st.stop()
 
             current_order = df_orders[df_orders['ID'] == selected_id].iloc[0]
-            
+
             st.markdown(f"""
             <div class="plan-box">
             <b>{current_order['الطلبية']}</b> (الحالة: {current_order['الحالة']})<br>
             المطلوب: {current_order['اجمالي_التكلفة']:,.0f} | <b>المدفوع: {current_order['المدفوع']:,.0f}</b>
             </div>
             """, unsafe_allow_html=True)
-            
+
             if not df_payments.empty:
-                history = df_payments[df_payments['OrderID'] == selected_id]
+                # من فهرس OrderID المبني مرة لكل تحميل (بدون المرور على كل الدفعات)
+                history = store.payment_history(selected_id)
                 if not history.empty:
                     st.markdown("🔹 **سجل العمليات السابقة:**")
                     st.dataframe(
-                        history[['التاريخ', 'المبلغ', 'البيان', 'رابط_السند']], 
+                        frame("payment_history", history[['التاريخ', 'المبلغ', 'البيان', 'رابط_السند']]),
                         use_container_width=True, hide_index=True,
                         column_config={
                             "رابط_السند": st.column_config.LinkColumn("السند"),
                             "المبلغ": st.column_config.NumberColumn(format="%.0f")
                         }
                     )
-            
+
             st.markdown("---")
             st.markdown("##### ➕ تسجيل عملية جديدة")
-            
+
             with st.form("new_payment_form"):
                 pay_date = st.date_input("تاريخ التحويل", value=datetime.now())
                 pay_amount = st.number_input("المبلغ (ريال)", min_value=0.0, step=1000.0)
                 pay_note = st.text_input("البيان / الوصف (مثلاً: دفعة مقدمة)")
                 pay_link = st.text_input("رابط السند (Google Drive Link)")
-                
+
                 try: idx_status = STATUS_LIST.index(current_order['الحالة'])
                 except: idx_status = 0
                 new_status = st.selectbox("تحديث حالة الطلب بالمرة؟", STATUS_LIST, index=idx_status)
-                
+
                 if st.form_submit_button("💾 حفظ الدفعة وتحديث الحالة"):
-                    new_pid = 1
-                    if not df_payments.empty and 'PaymentID' in df_payments.columns and len(df_payments) > 0:
-                        try: new_pid = int(df_payments['PaymentID'].max()) + 1
-                        except: new_pid = 1
-                        
+                    new_pid = write_queue.reserve_ids("payments")
+
                     new_payment_row = pd.DataFrame([{
                         "PaymentID": new_pid, "OrderID": selected_id,
                         "التاريخ": str(pay_date), "المبلغ": pay_amount, 
                         "البيان": pay_note, "رابط_السند": pay_link
                     }])
-                    
-                    updated_payments = pd.concat([df_payments, new_payment_row], ignore_index=True)
-                    conn.update(worksheet="payments", data=updated_payments)
-                    
+
+                    write_queue.append("payments", new_payment_row, origin=session_id)
+                    _, new_payment_row = coerce_frames(pd.DataFrame(), new_payment_row)
+
+                    # الإطارات من الكاش مشتركة بين الجلسات: ننسخ قبل التعديل
+                    df_orders = df_orders.copy()
                     idx = df_orders.index[df_orders['ID'] == selected_id][0]
                     today_str = datetime.now().strftime("%Y-%m-%d")
-                    
+
                     if new_status == "تم الاعتماد" and current_order['الحالة'] != "تم الاعتماد":
                         df_orders.at[idx, 'تاريخ_الاعتماد_الفعلي'] = today_str
                         df_orders.at[idx, 'تاريخ_الشحن_المتوقع'] = (datetime.now() + timedelta(days=30)).strftime("%Y-%m-%d")
                         df_orders.at[idx, 'تاريخ_الوصول_المتوقع'] = (datetime.now() + timedelta(days=60)).strftime("%Y-%m-%d")
-                    
+
                     if new_status == "تم الشحن" and current_order['الحالة'] != "تم الشحن":
                         df_orders.at[idx, 'تاريخ_الشحن_الفعلي'] = today_str
                         df_orders.at[idx, 'تاريخ_الوصول_المتوقع'] = (datetime.now() + timedelta(days=30)).strftime("%Y-%m-%d")
-                        
+
                     if new_status in ["وصلت للمستودع", "مسددة بالكامل"] and current_order['الحالة'] not in ["وصلت للمستودع", "مسددة بالكامل"]:
                         df_orders.at[idx, 'تاريخ_الوصول_الفعلي'] = today_str
 
                     df_orders.at[idx, 'الحالة'] = new_status
-                    
-                    conn.update(worksheet="Sheet1", data=df_orders)
-                    
+                    apply_payment(df_orders, selected_id, pay_amount)
+
+                    # تعديل خلايا هذه الطلبية فقط
+                    patch_cols = ['الحالة', 'المدفوع', 'المتبقي'] + [c for c in DATE_COLS if str(df_orders.at[idx, c]) != str(current_order[c])]
+                    # الحالة والتواريخ تتحقق من المصدر قبل الكتابة؛ المدفوع/المتبقي يعاد حسابهما من الدفعات عند كل تحميل
+                    expected = {c: current_order[c] for c in patch_cols if c not in ('المدفوع', 'المتبقي')}
+                    write_queue.patch("orders", {selected_id: df_orders.loc[idx, patch_cols].to_dict()}, expected={selected_id: expected},
+                                      hints={selected_id: int(idx) + 2}, origin=session_id)
+
+                    # تحديث الكاش وملخص الحالات في مكانهما (صف هذه الطلبية فقط)
+                    new_order = df_orders.loc[idx]
+                    sheet_cache.put((df_orders, append_frame(df_payments, new_payment_row)),
+                                    update={"summary": lambda summary: summary.replace(current_order, new_order)})
                     st.success("تم تسجيل الدفعة وتحديث الحالة!")
-                    st.cache_data.clear(); st.rerun()
+                    rerun()
+
+with c_right:
+    payments_panel()
+
+# --- 7. قياس الأداء (يظهر مع ?debug=1) ---
+perf_record = finish_run(perf_run)
+if st.query_params.get("debug") == "1":
+    with st.expander("⏱️ أداء هذه الدورة", expanded=False):
+        st.caption(f"الإجمالي: {perf_record['total_seconds']:.3f} ث — run {perf_record['run']}")
+        st.dataframe(pd.DataFrame(perf_record['sections']), use_container_width=True, hide_index=True)
+        st.dataframe(pd.DataFrame(perf_record['frames']), use_container_width=True, hide_index=True)
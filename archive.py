@@ -0,0 +1,47 @@
+import pandas as pd
+from ledger import StatusSummary, CLOSED_STATUSES
+from sheets import TOTALS_COLS
+
+# --- الأرشيف (تقسيم نشط/بارد): الطلبات المسددة بالكامل ودفعاتها تنقل من الأوراق النشطة ---
+# التحميل الافتراضي يقرأ الجزء النشط فقط؛ الأرشيف يقرأ عند الطلب،
+# ومجاميعه لكل سنة محفوظة مسبقاً حتى تبقى الكروت العلوية شاملة بدون قراءته.
+ARCHIVE_TABLES = {"orders": "orders_archive", "payments": "payments_archive"}
+TOTAL_VALUES = ["count", "total", "paid"]
+
+
+def archive_candidates(df_orders, today, older_than_days=0):
+    # أرقام الطلبات المسددة بالكامل التي وصلت قبل older_than_days يوماً أو أكثر (بدون تاريخ وصول = قديمة)
+    closed = df_orders['الحالة'].isin(CLOSED_STATUSES)
+    cutoff = pd.Timestamp(today).normalize() - pd.Timedelta(days=older_than_days)
+    old = ~(df_orders['تاريخ_الوصول_الفعلي'] > cutoff)
+    return [int(i) for i in df_orders.loc[closed & old, 'ID']]
+
+
+def split_archive(df_orders, df_payments, ids):
+    # صفوف الطلبات المختارة ودفعاتها
+    orders = df_orders[df_orders['ID'].isin(ids)]
+    if df_payments.empty:
+        return orders, df_payments
+    return orders, df_payments[df_payments['OrderID'].isin(ids)]
+
+
+def yearly_totals(df_orders):
+    # العدد/الإجمالي/المدفوع لكل سنة (سنة الاعتماد الفعلي وإلا الوصول المتوقع، كما في ملخص الحالات؛ 0 بدون تاريخ)
+    if df_orders.empty:
+        return pd.DataFrame(columns=TOTALS_COLS)
+    year = (StatusSummary.keys_of(df_orders)['الشهر'] // 100).rename("السنة")
+    values = pd.DataFrame({"count": 1, "total": df_orders['اجمالي_التكلفة'], "paid": df_orders['المدفوع']}, index=df_orders.index)
+    return values.groupby(year).sum().astype(float).reset_index()[TOTALS_COLS]
+
+
+def totals_changes(current, totals):
+    # الفرق بين المجاميع المحفوظة والمحسوبة من محتوى الأرشيف: (تعديلات السنوات الموجودة {السنة: القيم}، صفوف السنوات الجديدة)
+    current = current.drop_duplicates("السنة").set_index("السنة")
+    changes, new_rows = {}, []
+    for rec in totals.to_dict("records"):
+        year = int(rec["السنة"])
+        if year not in current.index:
+            new_rows.append(rec)
+        elif any(abs(float(current.at[year, c]) - rec[c]) > 1e-6 for c in TOTAL_VALUES):
+            changes[year] = {c: rec[c] for c in TOTAL_VALUES}
+    return changes, pd.DataFrame(new_rows, columns=TOTALS_COLS)
@@ -0,0 +1,306 @@
+"""قياس أداء مسارات التطبيق على بيانات مصطنعة.
+
+    python bench.py --orders 1000 10000 100000 --payments-per-order 3 --out bench.json
+    python bench.py --orders 10000 --baseline bench.json   # يفشل عند التراجع
+
+يطبع النتائج كسطور JSON (مرحلة/حجم/زمن) لمقارنتها بين الإصدارات.
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+from gspread.exceptions import WorksheetNotFound
+from gspread.utils import a1_to_rowcol
+
+from ledger import reconcile, status_totals, kpi_cards, StatusSummary, STATUS_LIST, FEES_FACTOR
+from sheets import prepare_frames, editor_delta, row_hints, ORDERS_SHEET, PAYMENTS_SHEET
+from storage import GSheetsStore, SQLiteStore
+from timeline import build_timeline, window_timeline
+from write_queue import WriteQueue
+from forecast import expand_obligations, bucket_obligations
+
+# --- توليد بيانات بنفس أعمدة الأوراق ---
+MILESTONES = [(30, 20, 50), (50, 0, 50), (20, 30, 50), (100, 0, 0)]
+SUPPLIERS = [f"مورد {i}" for i in range(1, 41)]
+
+
+def synthetic_sheets(n_orders, payments_per_order=3, seed=0):
+    rng = np.random.default_rng(seed)
+    today = pd.Timestamp(datetime.now().date())
+    ids = np.arange(1, n_orders + 1)
+    usd = rng.integers(1_000, 250_000, n_orders).astype(float)
+    rate = rng.choice([3.75, 3.76, 3.74], n_orders)
+    status_idx = rng.integers(0, len(STATUS_LIST), n_orders)
+    status = np.array(STATUS_LIST, dtype=object)[status_idx]
+    pct = np.array(MILESTONES)[rng.integers(0, len(MILESTONES), n_orders)]
+
+    # التواريخ تتبع الحالة: الاعتماد ثم الشحن ثم الوصول
+    conf = today - pd.to_timedelta(rng.integers(0, 365, n_orders), unit="D")
+    ship_exp = conf + pd.Timedelta(days=30)
+    arrive_exp = conf + pd.Timedelta(days=60)
+
+    def when(dates, min_idx):
+        out = pd.Series(dates.strftime("%Y-%m-%d"), dtype=object)
+        out[status_idx < min_idx] = None
+        return out
+
+    goods = usd * rate
+    fees = usd * FEES_FACTOR
+    orders = pd.DataFrame({
+        "ID": ids, "الطلبية": [f"طلبية {i}" for i in ids], "المورد": rng.choice(SUPPLIERS, n_orders),
+        "القيمة_دولار": usd, "سعر_الصرف": rate,
+        "قيمة_البضاعة_ريال": goods, "رسوم_شحن_تخليص": fees, "إجمالي_التكلفة": goods + fees,
+        "المدفوع": 0.0, "المتبقي": goods + fees, "الحالة": status, "ملاحظات": "",
+        "نسبة_اعتماد": pct[:, 0], "نسبة_شحن": pct[:, 1], "نسبة_وصول": pct[:, 2],
+        "تاريخ_الاعتماد_الفعلي": when(conf, 1),
+        "تاريخ_الشحن_المتوقع": when(ship_exp, 1),
+        "تاريخ_الشحن_الفعلي": when(ship_exp + pd.Timedelta(days=2), 3),
+        "تاريخ_الوصول_المتوقع": pd.Series(arrive_exp.strftime("%Y-%m-%d"), dtype=object),
+        "تاريخ_الوصول_الفعلي": when(arrive_exp + pd.Timedelta(days=3), 5),
+    })
+
+    # الدفعات: عدد عشوائي لكل طلبية بمتوسط payments_per_order وبجزء من الإجمالي
+    counts = rng.poisson(payments_per_order, n_orders)
+    order_ids = np.repeat(ids, counts)
+    totals = np.repeat(goods + fees, counts)
+    n_pay = len(order_ids)
+    pay_dates = today - pd.to_timedelta(rng.integers(0, 365, n_pay), unit="D")
+    payments = pd.DataFrame({
+        "PaymentID": np.arange(1, n_pay + 1), "OrderID": order_ids,
+        "التاريخ": pay_dates.strftime("%Y-%m-%d"),
+        "المبلغ": np.round(totals * rng.uniform(0.05, 0.3, n_pay), 2),
+        "البيان": rng.choice(["دفعة مقدمة", "دفعة شحن", "دفعة وصول"], n_pay),
+        "رابط_السند": "",
+    })
+    return orders, payments
+
+
+# --- اتصال وهمي في الذاكرة بنفس واجهة GSheetsConnection المستخدمة ---
+class MemoryWorksheet:
+    def __init__(self, df):
+        self.cells_sent = 0
+        self.set_frame(df)
+
+    def set_frame(self, df):
+        self.rows = [list(df.columns)] + df.astype(object).where(df.notna(), "").values.tolist()
+        self.cells_sent += df.size
+
+    def frame(self):
+        return pd.DataFrame(self.rows[1:], columns=self.rows[0]).replace("", np.nan)
+
+    def row_values(self, row):
+        return list(self.rows[row - 1])
+
+    def col_values(self, col):
+        return [r[col - 1] if col <= len(r) else "" for r in self.rows]
+
+    def update(self, range_name, values):
+        row, col = a1_to_rowcol(range_name)
+        for i, name in enumerate(values[0]):
+            self._set(row, col + i, name)
+
+    def append_rows(self, values, **kwargs):
+        self.rows.extend(list(r) for r in values)
+        self.cells_sent += sum(len(r) for r in values)
+
+    def batch_get(self, ranges):
+        out = []
+        for a1 in ranges:
+            row, col = a1_to_rowcol(a1)
+            r = self.rows[row - 1] if row <= len(self.rows) else []
+            out.append([[r[col - 1]]] if col <= len(r) else [])
+        return out
+
+    def batch_update(self, data, **kwargs):
+        for item in data:
+            self._set(*a1_to_rowcol(item["range"]), item["values"][0][0])
+        self.cells_sent += len(data)
+
+    def delete_rows(self, row):
+        del self.rows[row - 1]
+
+    def _set(self, row, col, value):
+        r = self.rows[row - 1]
+        r.extend([""] * (col - len(r)))
+        r[col - 1] = value
+
+
+class MemoryConnection:
+    def __init__(self, sheets):
+        self.sheets = {name: MemoryWorksheet(df) for name, df in sheets.items()}
+        self.client = self
+
+    def _select_worksheet(self, worksheet):
+        # مثل GSheetsConnection: ورقة غير موجودة (مثل أوراق الأرشيف قبل أول نقل) ترفع WorksheetNotFound
+        if worksheet not in self.sheets:
+            raise WorksheetNotFound(worksheet)
+        return self.sheets[worksheet]
+
+    def read(self, worksheet, ttl=0):
+        return self.sheets[worksheet].frame()
+
+    def update(self, worksheet, data):
+        self.sheets[worksheet].set_frame(data)
+
+    def cells_sent(self):
+        return sum(ws.cells_sent for ws in self.sheets.values())
+
+
+# --- القياس ---
+def timed(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return min(times), statistics.median(times)
+
+
+def run_size(n_orders, payments_per_order, repeat, backend):
+    raw_orders, raw_payments = synthetic_sheets(n_orders, payments_per_order)
+    df_orders, df_payments = prepare_frames(raw_orders, raw_payments)
+    today = datetime.now()
+    results = []
+
+    def record(stage, fn, store=None):
+        conn = getattr(store, "conn", None)
+        before = conn.cells_sent() if conn else 0
+        best, median = timed(fn, repeat)
+        row = {"stage": stage, "backend": backend, "orders": n_orders, "payments": len(raw_payments),
+               "seconds_min": round(best, 6), "seconds_median": round(median, 6)}
+        if conn:
+            row["cells_sent"] = (conn.cells_sent() - before) // repeat
+        results.append(row)
+
+    # 1. التحميل: تحويل الأنواع + مطابقة الدفعات
+    record("load_coerce", lambda: prepare_frames(raw_orders, raw_payments))
+    record("reconcile", lambda: reconcile(df_orders.copy(), df_payments))
+
+    # 2. الكروت العلوية
+    record("kpi", lambda: kpi_cards(status_totals(df_orders)))
+    summary = StatusSummary.build(df_orders)
+    old_row = df_orders.iloc[len(df_orders) // 2]
+    new_row = old_row.copy()
+    new_row['المدفوع'] += 1000
+    new_row['المتبقي'] -= 1000
+    record("kpi_incremental", lambda: (summary.replace(old_row, new_row), kpi_cards(summary.by_status())))
+
+    # 3. الجدول الزمني (كل الطلبات ثم النافذة المعروضة)
+    record("gantt_build", lambda: build_timeline(df_orders, today))
+    df_gantt = build_timeline(df_orders, today)
+    record("gantt_window", lambda: window_timeline(df_gantt, today - timedelta(days=30), today + timedelta(days=300), page_size=50))
+
+    # 4. توقع الاحتياج النقدي (التوسيع لكل المراحل ثم التجميع الشهري)
+    record("forecast", lambda: bucket_obligations(expand_obligations(df_orders, today), "M"))
+
+    # 5. مسارات الحفظ
+    if backend == "sqlite":
+        tmp = tempfile.NamedTemporaryFile(suffix=".db", delete=False).name
+        store = SQLiteStore(tmp)
+        store.seed(df_orders, df_payments)
+        record("load_store", store.load)
+    else:
+        store = GSheetsStore(MemoryConnection({ORDERS_SHEET: raw_orders, PAYMENTS_SHEET: raw_payments}))
+        record("load_store", store.load)
+        record("save_full_rewrite_baseline", lambda: store.conn.update(worksheet=ORDERS_SHEET, data=raw_orders), store)
+
+    hints = row_hints(df_orders)
+
+    # الدفعة كما يحفظها التطبيق: طلبية معتمدة تصبح "تم الشحن" (الحالة/المدفوع/المتبقي + تاريخا الشحن والوصول)،
+    # مع توقع الحالة والتواريخ قبل التعديل؛ كل تكرار على طلبية معتمدة مختلفة حتى لا يتعارض مع ما سبقه
+    approved = df_orders.loc[df_orders['الحالة'] == "تم الاعتماد", 'ID'].tolist()
+    direct, queued = iter(approved[0::2]), iter(approved[1::2])
+
+    def payment_save(order_id):
+        order = df_orders.loc[df_orders['ID'] == order_id].iloc[0]
+        payment = pd.DataFrame([{"PaymentID": None, "OrderID": order_id, "التاريخ": today.strftime("%Y-%m-%d"),
+                                 "المبلغ": 1000.0, "البيان": "bench", "رابط_السند": ""}])
+        changes = {"الحالة": "تم الشحن", "المدفوع": order['المدفوع'] + 1000.0, "المتبقي": order['المتبقي'] - 1000.0,
+                   "تاريخ_الشحن_الفعلي": today.strftime("%Y-%m-%d"),
+                   "تاريخ_الوصول_المتوقع": (today + timedelta(days=30)).strftime("%Y-%m-%d")}
+        expected = {c: order[c] for c in changes if c not in ("المدفوع", "المتبقي")}
+        return payment, {order_id: changes}, {order_id: expected}, {order_id: hints[order_id]}
+
+    def save_payment():
+        payment, changes, _, order_hints = payment_save(next(direct))
+        store.append("payments", payment.assign(PaymentID=store.next_id("payments")))
+        store.patch("orders", changes, hints=order_hints)
+
+    # نفس الحفظ عبر طابور الكتابة حتى يصل للمصدر (مع قراءة التحقق من التعارض قبل التعديل)
+    queue = WriteQueue(store)
+
+    def save_payment_queue():
+        payment, changes, expected, order_hints = payment_save(next(queued))
+        queue.append("payments", payment.assign(PaymentID=queue.reserve_ids("payments")))
+        queue.patch("orders", changes, expected=expected, hints=order_hints)
+        queue.flush()
+
+    def save_order():
+        new_id = store.next_id("orders")
+        # صف بعد التحويل (أسماء الأعمدة موحدة: اجمالي_التكلفة) كما يضيفه التطبيق
+        store.append("orders", df_orders.iloc[[0]].assign(ID=new_id))
+
+    edits = {"edited_rows": {pos: {"سعر_الصرف": 3.8} for pos in range(0, len(df_orders), max(1, len(df_orders) // 10))}}
+
+    def save_edits():
+        changes, added, deleted = editor_delta(df_orders, edits, FEES_FACTOR)
+        store.patch("orders", changes, hints=hints)
+
+    record("save_payment", save_payment, store)
+    record("save_payment_queue", save_payment_queue, store)
+    record("save_order", save_order, store)
+    record("save_edits", save_edits, store)
+    if backend == "sqlite":
+        os.remove(tmp)
+    return results
+
+
+def compare(results, baseline_path, tolerance):
+    # تراجع = زمن أبطأ من الأساس بأكثر من النسبة المسموحة
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = {(r["stage"], r["backend"], r["orders"]): r for r in map(json.loads, f)}
+    failures = []
+    for r in results:
+        base = baseline.get((r["stage"], r["backend"], r["orders"]))
+        if base and r["seconds_min"] > base["seconds_min"] * tolerance:
+            failures.append(f'{r["stage"]} @ {r["orders"]}: {base["seconds_min"]:.4f}s -> {r["seconds_min"]:.4f}s')
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--orders", type=int, nargs="+", default=[1_000, 10_000, 100_000])
+    parser.add_argument("--payments-per-order", type=float, default=3)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--backend", choices=["gsheets", "sqlite"], default="gsheets")
+    parser.add_argument("--out", help="ملف JSON lines للنتائج")
+    parser.add_argument("--baseline", help="نتائج سابقة للمقارنة")
+    parser.add_argument("--tolerance", type=float, default=1.25)
+    args = parser.parse_args(argv)
+
+    results = []
+    for n in args.orders:
+        results += run_size(n, args.payments_per_order, args.repeat, args.backend)
+
+    lines = [json.dumps(r, ensure_ascii=False) for r in results]
+    print("\n".join(lines))
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+    if args.baseline:
+        failures = compare(results, args.baseline, args.tolerance)
+        for line in failures:
+            print("REGRESSION", line, file=sys.stderr)
+        return 1 if failures else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
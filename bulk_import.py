@@ -0,0 +1,166 @@
+import pandas as pd
+from datetime import datetime, date, timedelta
+from ledger import order_costs, paid_by_order, STATUS_LIST
+from sheets import parse_sheet, ORDERS_SCHEMA, PAYMENTS_SCHEMA, ORD_COLS, PAY_COLS
+
+# --- استيراد جماعي للطلبات والدفعات من ملفات Excel/CSV ---
+# الملف يقرأ على أجزاء (chunks)، وكل صف يمر بنفس تحويل الأنواع ونفس الحقول المشتقة لنموذج الإضافة،
+# والأخطاء ترجع لكل صف برقمه في الملف بدلاً من إيقاف الاستيراد كله.
+CHUNK_ROWS = 2_000
+BATCH_ROWS = 500
+ERROR_COLS = ["الصف", "العمود", "القيمة", "الخطأ"]
+
+# نفس القيم الافتراضية في نموذج "تسجيل طلبية جديدة"
+ORDER_DEFAULTS = {"سعر_الصرف": 3.75, "نسبة_اعتماد": 30, "نسبة_شحن": 20, "نسبة_وصول": 50, "الحالة": "لم يبدأ"}
+
+
+def read_chunks(file, name, chunk_rows=CHUNK_ROWS):
+    # يرجع أجزاء DataFrame بالخلايا كما هي؛ الفهرس = موضع الصف بعد العناوين (رقم الصف في الملف = الفهرس + 2)
+    if name.lower().endswith(".csv"):
+        # الأسطر الفارغة تبقى في القراءة حتى لا تزيح الترقيم، ثم تسقط مثل الصفوف الفارغة في Excel
+        for chunk in pd.read_csv(file, chunksize=chunk_rows, dtype=str, encoding="utf-8-sig", skip_blank_lines=False):
+            chunk = chunk.dropna(how="all")
+            if not chunk.empty: yield chunk
+        return
+
+    from openpyxl import load_workbook
+    wb = load_workbook(file, read_only=True, data_only=True)
+    try:
+        rows = wb.worksheets[0].iter_rows(values_only=True)
+        header = [str(h).strip() if h is not None else "" for h in next(rows, [])]
+        buf = []
+        for n, row in enumerate(rows):
+            if all(v is None or v == "" for v in row): continue
+            buf.append((n, row))
+            if len(buf) == chunk_rows:
+                yield _frame(header, buf)
+                buf = []
+        if buf:
+            yield _frame(header, buf)
+    finally:
+        wb.close()
+
+
+def _frame(header, buf):
+    index = [n for n, _ in buf]
+    values = [list(row[:len(header)]) + [None] * (len(header) - len(row)) for _, row in buf]
+    df = pd.DataFrame(values, columns=header, index=index).astype(object)
+    return df.drop(columns=[c for c in df.columns if not c])
+
+
+def _errors(df, mask, col, message):
+    return pd.DataFrame({"الصف": df.index[mask] + 2, "العمود": col, "القيمة": df.loc[mask, col].astype(str).values, "الخطأ": message})
+
+
+def _finish(df, report, errors):
+    # أخطاء التحويل (نص في عمود رقم/تاريخ) من parse_sheet + أخطاء التحقق، ثم إسقاط كل صف فيه خطأ
+    # (الخلية غير الصالحة تقرأ 0 فلا تتكرر بخطأ "أكبر من صفر")
+    errors = [r.drop(columns="الورقة").assign(الخطأ="قيمة غير صالحة") for r in report] + errors
+    errors = pd.concat(errors, ignore_index=True).drop_duplicates(["الصف", "العمود"], ignore_index=True)
+    return df[~(df.index + 2).isin(errors["الصف"])].copy(), errors
+
+
+def prepare_orders(chunk, fees_factor, today=None):
+    # ترجع (الصفوف الصالحة بدون ID، أخطاء الصفوف)
+    today = pd.Timestamp(today or datetime.now().date())
+    raw = chunk.copy()
+    for col, default in ORDER_DEFAULTS.items():
+        if col not in raw.columns: raw[col] = default
+        else: raw[col] = raw[col].where(raw[col].notna() & (raw[col].astype(str).str.strip() != ""), default)
+
+    report = []
+    df = parse_sheet(raw, ORDERS_SCHEMA, "import", report)
+    name = df['الطلبية'].astype(object)
+    df, errors = _finish(df, report, [
+        _errors(df, name.isna() | (name.astype(str).str.strip() == ""), "الطلبية", "اسم الطلبية مطلوب"),
+        _errors(df, df['القيمة_دولار'] <= 0, "القيمة_دولار", "القيمة يجب أن تكون أكبر من صفر"),
+        _errors(df, df['سعر_الصرف'] <= 0, "سعر_الصرف", "سعر الصرف يجب أن يكون أكبر من صفر"),
+        _errors(df, ~df['الحالة'].isin(STATUS_LIST), "الحالة", "حالة غير معروفة"),
+    ])
+
+    # الحقول المشتقة كما في نموذج الإضافة: الريال + الرسوم + الإجمالي، والمدفوع يأتي من الدفعات
+    df['المدفوع'] = 0.0
+    for col, vals in order_costs(df['القيمة_دولار'], df['سعر_الصرف'], df['المدفوع'], fees_factor).items():
+        df[col] = vals
+    # الطلبية المعتمدة بدون تواريخ تأخذ مواعيد النموذج (الشحن +30 والوصول +60 يوماً)
+    approved = df['الحالة'] == "تم الاعتماد"
+    df.loc[approved, 'تاريخ_الاعتماد_الفعلي'] = df.loc[approved, 'تاريخ_الاعتماد_الفعلي'].fillna(today)
+    df.loc[approved, 'تاريخ_الشحن_المتوقع'] = df.loc[approved, 'تاريخ_الشحن_المتوقع'].fillna(today + timedelta(days=30))
+    df.loc[approved, 'تاريخ_الوصول_المتوقع'] = df.loc[approved, 'تاريخ_الوصول_المتوقع'].fillna(today + timedelta(days=60))
+    df['تاريخ_الوصول_المتوقع'] = df['تاريخ_الوصول_المتوقع'].fillna(today)
+    df['الحالة'] = df['الحالة'].astype(object)
+    df['المورد'] = df['المورد'].astype(object)
+    return df[ORD_COLS], errors
+
+
+def prepare_payments(chunk, order_ids, today=None):
+    # order_ids: أرقام الطلبات الموجودة (أي دفعة لطلبية غير موجودة ترفض)
+    today = datetime.now().strftime("%Y-%m-%d") if today is None else str(today)
+    if 'التاريخ' in chunk.columns:
+        # التاريخ في الدفعات نص: خلايا التاريخ في Excel تكتب بنفس صيغة الورقة
+        chunk = chunk.assign(التاريخ=chunk['التاريخ'].map(lambda v: v.strftime("%Y-%m-%d") if isinstance(v, date) else v))
+    report = []
+    df = parse_sheet(chunk, PAYMENTS_SCHEMA, "import", report)
+    df, errors = _finish(df, report, [
+        _errors(df, ~df['OrderID'].isin(order_ids), "OrderID", "رقم الطلبية غير موجود"),
+        _errors(df, df['المبلغ'] <= 0, "المبلغ", "المبلغ يجب أن يكون أكبر من صفر"),
+    ])
+    df['التاريخ'] = df['التاريخ'].fillna(today)
+    return df[PAY_COLS], errors
+
+
+def plan_import(file, name, table, fees_factor, order_ids=(), chunk_rows=CHUNK_ROWS):
+    # قراءة الملف كاملاً على أجزاء: (الصفوف الصالحة، تقرير الأخطاء لكل صف)
+    rows, errors = [], []
+    order_ids = pd.Index(order_ids)
+    for chunk in read_chunks(file, name, chunk_rows):
+        if table == "orders":
+            valid, bad = prepare_orders(chunk, fees_factor)
+        else:
+            valid, bad = prepare_payments(chunk, order_ids)
+        rows.append(valid)
+        errors.append(bad)
+    cols = ORD_COLS if table == "orders" else PAY_COLS
+    rows = pd.concat(rows) if rows else pd.DataFrame(columns=cols)
+    errors = pd.concat(errors).sort_values("الصف", kind="stable", ignore_index=True) if errors else pd.DataFrame(columns=ERROR_COLS)
+    return rows, errors
+
+
+def recheck_payments(rows, order_ids):
+    # عند الحفظ: الطلبات قد تغيرت منذ تحليل الملف (حذف/أرشفة) — دفعات الطلبات غير الموجودة لا تحفظ
+    missing = ~rows['OrderID'].isin(order_ids)
+    return rows[~missing], _errors(rows, missing, "OrderID", "رقم الطلبية غير موجود")
+
+
+def commit_import(writer, table, rows, batch_rows=BATCH_ROWS, progress=None):
+    # حفظ على دفعات: كتلة IDs متتالية لكل دفعة (حجز واحد) ثم إضافة الصفوف بطلب واحد
+    # writer: طبقة التخزين مباشرة أو طابور الكتابة (WriteQueue) الذي يرجع عملية يمكن انتظارها
+    key = "ID" if table == "orders" else "PaymentID"
+    saved, queued = [], []
+    for start in range(0, len(rows), batch_rows):
+        batch = rows.iloc[start:start + batch_rows].copy()
+        first = writer.reserve_ids(table, len(batch))
+        batch[key] = range(first, first + len(batch))
+        op = writer.append(table, batch)
+        saved.append(batch)
+        done = min(start + batch_rows, len(rows)) / len(rows)
+        if op is None:
+            if progress: progress(done)
+        else:
+            queued.append((op, done))
+    # مع الطابور: التقدم يتبع الدفعات التي وصلت للمصدر لا التي أضيفت للطابور
+    for op, done in queued:
+        writer.wait(op)
+        if progress: progress(done)
+    return pd.concat(saved, ignore_index=True) if saved else rows.iloc[0:0]
+
+
+def paid_patch(df_orders, df_payments, order_ids):
+    # المدفوع/المتبقي الجديد للطلبات التي وصلتها دفعات مستوردة (للحفظ بخلايا هذه الطلبات فقط)
+    paid = paid_by_order(df_payments)
+    target = df_orders[df_orders['ID'].isin(order_ids)]
+    changes = {}
+    for oid, total in zip(target['ID'], target['اجمالي_التكلفة']):
+        amount = float(paid.get(oid, 0.0))
+        changes[int(oid)] = {"المدفوع": amount, "المتبقي": total - amount}
+    return changes
@@ -0,0 +1,168 @@
+import os
+import threading
+import time
+import logging
+import pandas as pd
+
+# --- كاش البيانات (stale-while-revalidate) مع نسخة محلية على القرص ---
+# يقدم آخر نسخة سليمة من الذاكرة أو من ملفات Parquet فوراً،
+# ويحدثها من المصدر في الخلفية عندما تصبح قديمة.
+
+log = logging.getLogger(__name__)
+
+REFRESH_SECONDS = 30
+SNAPSHOT_DIR = os.environ.get("SHAN_SNAPSHOT_DIR", ".snapshot")
+
+
+class SheetCache:
+    def __init__(self, loader, snapshot_dir=SNAPSHOT_DIR, refresh_seconds=REFRESH_SECONDS):
+        self._loader = loader                  # دالة ترجع (df_orders, df_payments) بعد التحويل
+        self._snapshot_dir = snapshot_dir
+        self._refresh_seconds = refresh_seconds
+        self._lock = threading.Lock()
+        self._frames = None
+        self._loaded_at = 0.0
+        self._refreshing = False
+        self._generation = 0                   # يزيد مع كل إسقاط للكاش
+        self._derived = {}                     # ملخصات مبنية من الإطارات الحالية (مثل ملخص الحالات)
+        self.last_error = None
+
+    # --- القراءة ---
+    def get(self, copy=True):
+        with self._lock:
+            frames = self._frames
+            age = time.time() - self._loaded_at
+
+        if frames is None:
+            frames = self._read_snapshot()
+            if frames is not None:
+                # بداية باردة: نعرض النسخة المحلية ونحدّث في الخلفية
+                with self._lock:
+                    self._frames = frames
+                    self._derived = {}
+                    self._loaded_at = 0.0
+                self._refresh_async()
+            else:
+                frames = self._refresh()
+        elif age > self._refresh_seconds:
+            self._refresh_async()
+
+        df_orders, df_payments = frames
+        if not copy:
+            return df_orders, df_payments
+        # نسخ لمن يعدل الجداول في مكانها
+        return df_orders.copy(), df_payments.copy()
+
+    def peek(self):
+        # نفس الإطارات بدون نسخ — للقراءة فقط (التجميع والبحث)
+        with self._lock:
+            frames = self._frames
+        if frames is None:
+            self.get()
+            with self._lock:
+                frames = self._frames
+        return frames
+
+    def loaded(self):
+        # توجد إطارات في الذاكرة (False قبل أول تحميل ناجح أو بعد الإسقاط)
+        with self._lock:
+            return self._frames is not None
+
+    def derived(self, name, build):
+        # ملخص محسوب مرة واحدة لكل نسخة من البيانات
+        frames = self.peek()
+        with self._lock:
+            if name in self._derived and self._frames is frames:
+                return self._derived[name]
+        value = build(*frames)
+        with self._lock:
+            if self._frames is frames:
+                self._derived[name] = value
+        return value
+
+    def put(self, frames, update=None):
+        # كتابة مباشرة بعد حفظ التطبيق نفسه: نستبدل الإطارات ونحدث الملخصات في مكانها
+        # update: {اسم الملخص: دالة تعدله} — ما لم يذكر يعاد بناؤه عند الطلب
+        update = update or {}
+        with self._lock:
+            self._frames = frames
+            self._generation += 1
+            self._derived = {name: value for name, value in self._derived.items() if name in update}
+            for name, fn in update.items():
+                if name in self._derived:
+                    fn(self._derived[name])
+
+    # --- الإسقاط بعد كتابات التطبيق نفسه ---
+    def invalidate(self):
+        with self._lock:
+            self._frames = None
+            self._loaded_at = 0.0
+            self._generation += 1
+            self._derived = {}
+        self._drop_snapshot()
+
+    # --- التحديث من المصدر ---
+    def _refresh(self):
+        with self._lock:
+            generation = self._generation
+        frames = self._loader()
+        with self._lock:
+            # لا نكتب فوق إسقاط حدث أثناء القراءة
+            current = generation == self._generation
+            if current:
+                self._frames = frames
+                self._derived = {}
+                self._loaded_at = time.time()
+                self.last_error = None
+        if current:
+            self._write_snapshot(frames)
+        return frames
+
+    def _refresh_async(self):
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+
+        def run():
+            try:
+                self._refresh()
+            except Exception as e:
+                # نبقي آخر نسخة سليمة ونسجل الخطأ
+                log.warning("background refresh failed: %s", e)
+                self.last_error = e
+            finally:
+                with self._lock:
+                    self._refreshing = False
+
+        threading.Thread(target=run, daemon=True).start()
+
+    # --- النسخة المحلية (Parquet) ---
+    def _paths(self):
+        return (os.path.join(self._snapshot_dir, "orders.parquet"),
+                os.path.join(self._snapshot_dir, "payments.parquet"))
+
+    def _read_snapshot(self):
+        orders_path, payments_path = self._paths()
+        if not (os.path.exists(orders_path) and os.path.exists(payments_path)):
+            return None
+        try:
+            return pd.read_parquet(orders_path), pd.read_parquet(payments_path)
+        except Exception as e:
+            log.warning("snapshot read failed: %s", e)
+            return None
+
+    def _write_snapshot(self, frames):
+        try:
+            os.makedirs(self._snapshot_dir, exist_ok=True)
+            for df, path in zip(frames, self._paths()):
+                tmp = path + ".tmp"
+                df.to_parquet(tmp, index=False)
+                os.replace(tmp, path)
+        except Exception as e:
+            log.warning("snapshot write failed: %s", e)
+
+    def _drop_snapshot(self):
+        for path in self._paths():
+            try: os.remove(path)
+            except FileNotFoundError: pass
@@ -0,0 +1,73 @@
+import numpy as np
+import pandas as pd
+from datetime import timedelta
+from ledger import CLOSED_STATUSES
+
+# --- توقع التدفق النقدي: كل طلبية مفتوحة -> دفعات مستحقة بتاريخ حسب نسب الاعتماد/الشحن/الوصول ---
+# بعمليات على الأعمدة لكل الطلبات مرة واحدة (بدون المرور على الصفوف).
+MILESTONES = ["اعتماد", "شحن", "وصول"]
+PCT_COLS = ["نسبة_اعتماد", "نسبة_شحن", "نسبة_وصول"]
+FORECAST_COLS = ["ID", "الطلبية", "المورد", "المرحلة", "الاستحقاق", "المبلغ", "متأخرة"]
+DAYS_30 = timedelta(days=30)
+DAYS_60 = timedelta(days=60)
+
+
+def milestone_dates(df_orders, today, delay_days=0):
+    # تاريخ كل مرحلة: الفعلي إن وجد، وإلا المتوقع مؤخراً بـ delay_days (نفس افتراضات الجدول الزمني)
+    delay = pd.Timedelta(days=delay_days)
+    arrive_exp = df_orders['تاريخ_الوصول_المتوقع'] + delay
+    planned = (arrive_exp.fillna(today + DAYS_60) - DAYS_60).clip(lower=today)
+    approve = df_orders['تاريخ_الاعتماد_الفعلي'].fillna(planned)
+    ship = df_orders['تاريخ_الشحن_الفعلي'].fillna(df_orders['تاريخ_الشحن_المتوقع'] + delay).fillna(approve + DAYS_30)
+    arrive = df_orders['تاريخ_الوصول_الفعلي'].fillna(arrive_exp).fillna(ship + DAYS_30)
+    return np.column_stack([approve.to_numpy(), ship.to_numpy(), arrive.to_numpy()])
+
+
+def expand_obligations(df_orders, today, delay_days=0, rate_shift=0.0):
+    # صف لكل (طلبية مفتوحة × مرحلة) بالمبلغ غير المدفوع منها
+    # rate_shift: تغير سعر الصرف كنسبة (0.02 = +2%) على قيمة البضاعة فقط (الرسوم بالدولار × معامل ثابت)
+    today = pd.Timestamp(today).normalize()
+    open_orders = df_orders[~df_orders['الحالة'].isin(CLOSED_STATUSES)]
+    if open_orders.empty:
+        return pd.DataFrame(columns=FORECAST_COLS)
+
+    total = open_orders['اجمالي_التكلفة'] + open_orders['القيمة_دولار'] * open_orders['سعر_الصرف'] * rate_shift
+    pct = open_orders[PCT_COLS].to_numpy(dtype=float, copy=True)
+    # الطلبية بدون نسب تستحق كاملة عند الوصول
+    pct[pct.sum(axis=1) == 0, 2] = 100
+    share = pct / pct.sum(axis=1, keepdims=True) * total.to_numpy()[:, None]
+
+    # المدفوع يغطي المراحل بالترتيب: الاعتماد ثم الشحن ثم الوصول
+    paid = open_orders['المدفوع'].to_numpy()[:, None]
+    covered_before = np.cumsum(share, axis=1) - share
+    due = np.clip(share - np.clip(paid - covered_before, 0, None), 0, None)
+
+    dates = milestone_dates(open_orders, today, delay_days)
+    # نأخذ فقط الخلايا المستحقة (المبلغ > 0) ونكرر أعمدة الطلبية بمواضعها بدون إعادة بناء النصوص
+    rows, stage = np.nonzero(due > 0.005)
+    base = open_orders[['ID', 'الطلبية', 'المورد']].iloc[rows].reset_index(drop=True)
+    out = base.assign(**{
+        "المرحلة": pd.Categorical.from_codes(stage, MILESTONES),
+        "الاستحقاق": pd.to_datetime(dates[rows, stage]),
+        "المبلغ": due[rows, stage],
+    })
+    # ما فات موعده ولم يدفع يستحق اليوم
+    out['متأخرة'] = out['الاستحقاق'] < today
+    out['الاستحقاق'] = out['الاستحقاق'].clip(lower=today)
+    return out.reset_index(drop=True)[FORECAST_COLS]
+
+
+def bucket_obligations(obligations, freq="M", horizon=None):
+    # مجموع المستحق لكل فترة (W أسبوع / M شهر) ولكل مرحلة، مع التراكمي
+    if obligations.empty:
+        return pd.DataFrame(columns=["الفترة"] + MILESTONES + ["الإجمالي", "التراكمي"])
+    if horizon is not None:
+        obligations = obligations[obligations['الاستحقاق'] <= pd.Timestamp(horizon)]
+    period = obligations['الاستحقاق'].dt.to_period(freq).dt.start_time
+    table = obligations['المبلغ'].groupby([period, obligations['المرحلة']]).sum().unstack(fill_value=0)
+    table = table.reindex(columns=MILESTONES, fill_value=0)
+    table.columns.name = None
+    table['الإجمالي'] = table.sum(axis=1)
+    table['التراكمي'] = table['الإجمالي'].cumsum()
+    table.index.name = "الفترة"
+    return table.reset_index()
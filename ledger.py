@@ -0,0 +1,166 @@
+import pandas as pd
+
+# --- الثوابت ---
+STATUS_LIST = ["لم يبدأ", "تم الاعتماد", "جاري التجهيز", "تم الشحن", "تخليص جمركي", "وصلت للمستودع", "مسددة بالكامل"]
+FEES_FACTOR = 0.744
+
+# --- دفتر الدفعات: حساب المدفوع/المتبقي لكل الطلبات دفعة واحدة ---
+
+
+def paid_by_order(df_payments):
+    # مجموع المدفوع لكل طلبية (OrderID -> المبلغ)
+    if df_payments.empty:
+        return pd.Series(dtype=float)
+    return df_payments.groupby('OrderID')['المبلغ'].sum()
+
+
+def reconcile(df_orders, df_payments):
+    # ربط الدفعات بالطلبات عبر map بدلاً من المرور على كل صف
+    if df_orders.empty:
+        return df_orders
+    if not df_payments.empty:
+        df_orders['المدفوع'] = df_orders['ID'].map(paid_by_order(df_payments)).fillna(0)
+    df_orders['المتبقي'] = df_orders['اجمالي_التكلفة'] - df_orders['المدفوع']
+    return df_orders
+
+
+def apply_payment(df_orders, order_id, amount):
+    # تطبيق دفعة جديدة كفرق (delta) على الطلبية فقط بدون إعادة الحساب للكل
+    mask = df_orders['ID'] == order_id
+    if not mask.any():
+        return False
+    df_orders.loc[mask, 'المدفوع'] = df_orders.loc[mask, 'المدفوع'] + amount
+    df_orders.loc[mask, 'المتبقي'] = df_orders.loc[mask, 'اجمالي_التكلفة'] - df_orders.loc[mask, 'المدفوع']
+    return True
+
+
+def orphan_payments(df_orders, df_payments):
+    # دفعات رقم طلبيتها غير موجود في سجل الطلبات
+    if df_payments.empty:
+        return df_payments
+    return df_payments[~df_payments['OrderID'].isin(df_orders['ID'])]
+
+
+def order_costs(usd, rate, paid, fees_factor):
+    # الحقول المشتقة لطلبية (تعمل على قيم مفردة أو أعمدة كاملة)
+    goods = usd * rate
+    fees = usd * fees_factor
+    total = goods + fees
+    return {"قيمة_البضاعة_ريال": goods, "رسوم_شحن_تخليص": fees, "اجمالي_التكلفة": total, "المتبقي": total - paid}
+
+
+# --- ملخص الحالات (العدد/الإجمالي/المدفوع/المتبقي لكل حالة) ---
+SUMMARY_COLS = ["count", "total", "paid", "remaining"]
+NOT_LIABILITY = ["لم يبدأ", "مسددة بالكامل"]
+CLOSED_STATUSES = ["مسددة بالكامل"]   # لا التزام متبقٍ (خارج التوقع، وتصلح للأرشفة)
+
+
+def status_totals(df_orders):
+    return StatusSummary.build(df_orders).by_status()
+
+
+class StatusSummary:
+    # خلايا صغيرة (الحالة × المورد × الشهر) تُبنى بتجميع واحد، ومنها كل الملخصات بدون المرور على الطلبات.
+    # تُحدث في مكانها عند حفظ دفعة أو تغيير حالة بدلاً من إعادة البناء.
+    KEYS = ["الحالة", "المورد", "الشهر"]
+
+    def __init__(self, cells):
+        self.cells = cells
+
+    @staticmethod
+    def keys_of(df_orders):
+        # الشهر = شهر الاعتماد الفعلي، وإن لم يوجد فشهر الوصول المتوقع (كرقم YYYYMM، و0 بدون تاريخ)
+        month = pd.to_datetime(df_orders['تاريخ_الاعتماد_الفعلي'].fillna(df_orders['تاريخ_الوصول_المتوقع']), errors='coerce')
+        return pd.DataFrame({
+            "الحالة": df_orders['الحالة'].astype(object).fillna(""),
+            "المورد": df_orders['المورد'].astype(object).fillna(""),
+            "الشهر": (month.dt.year * 100 + month.dt.month).fillna(0).astype(int),
+        }, index=df_orders.index)
+
+    @classmethod
+    def build(cls, df_orders):
+        if df_orders.empty:
+            index = pd.MultiIndex.from_tuples([], names=cls.KEYS)
+            return cls(pd.DataFrame(columns=SUMMARY_COLS, index=index, dtype=float))
+        values = pd.DataFrame({
+            "count": 1, "total": df_orders['اجمالي_التكلفة'],
+            "paid": df_orders['المدفوع'], "remaining": df_orders['المتبقي'],
+        }, index=df_orders.index)
+        cells = values.join(cls.keys_of(df_orders)).groupby(cls.KEYS).sum()
+        return cls(cells.astype(float))
+
+    @staticmethod
+    def key_of(order):
+        # نفس مفتاح keys_of لطلبية واحدة (صف Series)
+        month = order['تاريخ_الاعتماد_الفعلي']
+        if pd.isna(month): month = order['تاريخ_الوصول_المتوقع']
+        month = pd.to_datetime(month, errors='coerce')
+        status, supplier = order['الحالة'], order['المورد']
+        return ("" if pd.isna(status) else status, "" if pd.isna(supplier) else supplier,
+                0 if pd.isna(month) else month.year * 100 + month.month)
+
+    def _add(self, order, sign):
+        key = self.key_of(order)
+        delta = [sign, sign * order['اجمالي_التكلفة'], sign * order['المدفوع'], sign * order['المتبقي']]
+        if key in self.cells.index:
+            pos = self.cells.index.get_loc(key)
+            self.cells.iloc[pos] = self.cells.iloc[pos].to_numpy() + delta
+            if self.cells.iat[pos, 0] == 0:
+                self.cells = self.cells.drop(index=[key])
+        else:
+            self.cells.loc[key, SUMMARY_COLS] = delta
+
+    def add(self, order):
+        self._add(order, 1)
+
+    def replace(self, old, new):
+        # طلبية تغيرت (دفعة/حالة/تاريخ): نطرح صفها القديم ونضيف الجديد
+        self._add(old, -1)
+        self._add(new, 1)
+
+    def _rollup(self, level):
+        return self.cells.groupby(level=level).sum()
+
+    def by_status(self):
+        totals = self._rollup("الحالة")
+        totals['count'] = totals['count'].astype(int)
+        return totals
+
+    def by_supplier(self):
+        return self._rollup("المورد")
+
+    def by_month(self):
+        totals = self._rollup("الشهر")
+        totals.index = [f"{m // 100}-{m % 100:02d}" if m else "" for m in totals.index]
+        totals.index.name = "الشهر"
+        return totals
+
+
+def kpi_cards(totals, archived=None):
+    # أرقام الكروت العلوية من ملخص الحالات (بدون المرور على الطلبات)
+    # archived: المجاميع السنوية المحفوظة للأرشيف (كلها مسددة بالكامل) حتى يبقى المكتمل والمستهدف شاملين
+    active = totals[~totals.index.isin(NOT_LIABILITY)]
+    count = totals['count']
+    archived_count = 0 if archived is None else int(archived['count'].sum())
+    archived_total = 0.0 if archived is None else archived['total'].sum()
+    return {
+        "cnt_active": int(active['count'].sum()),
+        "liability_total": active['total'].sum(),
+        "liability_paid": active['paid'].sum(),
+        "liability_rem": active['remaining'].sum(),
+        "cnt_completed_final": int(count.get("مسددة بالكامل", 0)) + archived_count,
+        "cnt_shipped": int(count.get("تم الشحن", 0)),
+        "cnt_customs": int(count.get("تخليص جمركي", 0)),
+        "target_year_total": totals['total'].sum() + archived_total,
+    }
+
+
+# --- فهرس الدفعات: OrderID -> مواضع صفوفه في جدول الدفعات (يبنى مرة لكل تحميل) ---
+def payment_index(df_payments):
+    if df_payments.empty:
+        return {}
+    return df_payments.groupby('OrderID').indices
+
+
+def payments_of(df_payments, index, order_id):
+    return df_payments.iloc[index.get(order_id, [])]
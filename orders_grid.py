@@ -0,0 +1,21 @@
+import pandas as pd
+
+# --- فلترة وتقسيم سجل الطلبات إلى صفحات على الخادم (يرسل للمتصفح الصفحة الظاهرة فقط) ---
+GRID_DATE_COL = "تاريخ_الوصول_المتوقع"
+
+
+def filter_orders(df_orders, statuses=None, suppliers=None, start=None, end=None, text=""):
+    mask = pd.Series(True, index=df_orders.index)
+    if statuses: mask &= df_orders['الحالة'].isin(statuses)
+    if suppliers: mask &= df_orders['المورد'].isin(suppliers)
+    if start is not None: mask &= df_orders[GRID_DATE_COL] >= pd.Timestamp(start)
+    if end is not None: mask &= df_orders[GRID_DATE_COL] <= pd.Timestamp(end)
+    if text: mask &= df_orders['الطلبية'].str.contains(text, case=False, regex=False, na=False)
+    return df_orders[mask]
+
+
+def page_of(df, page, page_size):
+    # ترجع (صفوف الصفحة، عدد الصفحات) — الفهرس الأصلي يبقى كما هو لمعرفة موضع الصف في الورقة
+    pages = max(1, -(-len(df) // page_size))
+    page = min(max(page, 1), pages)
+    return df.iloc[(page - 1) * page_size:page * page_size], pages
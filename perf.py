@@ -0,0 +1,126 @@
+import contextvars
+import functools
+import json
+import logging
+import os
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+
+# --- قياس زمن كل جزء من السكربت في كل إعادة تشغيل ---
+# السجل النشط مرتبط بخيط التشغيل الحالي؛ خارج أي تشغيل (مثل تحديث الكاش في الخلفية) لا يُسجل شيء.
+
+log = logging.getLogger("shan.perf")
+PERF_LOG = os.environ.get("SHAN_PERF_LOG")   # ملف JSON lines اختياري بجانب السجل العادي
+
+# بدون إعداد للسجل لا يظهر INFO (معالج Python الأخير يطبع WARNING فأعلى): سطر JSON على stderr افتراضياً
+if not log.handlers:
+    _handler = logging.StreamHandler()
+    _handler.setFormatter(logging.Formatter("%(message)s"))
+    log.addHandler(_handler)
+    log.setLevel(os.environ.get("SHAN_PERF_LEVEL", "INFO"))
+    log.propagate = False
+
+_current = contextvars.ContextVar("perf_run", default=None)
+
+
+class PerfRun:
+    def __init__(self, name="rerun"):
+        self.name = name
+        self.run_id = uuid.uuid4().hex[:8]
+        self.started = time.perf_counter()
+        self._last_lap = self.started
+        self.sections = []   # [{section, seconds, rows?}]
+        self.frames = []     # الجداول المرسلة للمتصفح: [{frame, rows, memory_bytes}]
+        self.record = None   # السجل بعد finish_run (مرة واحدة)
+
+    def add(self, section, seconds, **extra):
+        self.sections.append({"section": section, "seconds": round(seconds, 6), **extra})
+
+    def lap(self, name, **extra):
+        # زمن الجزء منذ آخر lap (يغني عن لف أجزاء السكربت الطويلة في with)
+        now = time.perf_counter()
+        self.add(name, now - self._last_lap, **extra)
+        self._last_lap = now
+
+    def add_frame(self, name, df):
+        # حجم الإطار في ذاكرة pandas (مؤشر تقريبي، لا حجم رسالة Arrow المرسلة)
+        self.frames.append({"frame": name, "rows": int(len(df)), "memory_bytes": int(df.memory_usage(deep=True, index=True).sum())})
+
+    def to_dict(self):
+        return {
+            "ts": datetime.now().isoformat(timespec="seconds"), "run": self.run_id, "name": self.name,
+            "total_seconds": round(time.perf_counter() - self.started, 6),
+            "sections": self.sections, "frames": self.frames,
+        }
+
+
+def start_run(name="rerun"):
+    run = PerfRun(name)
+    _current.set(run)
+    return run
+
+
+def finish_run(run):
+    if run.record is not None:
+        return run.record
+    record = run.record = run.to_dict()
+    line = json.dumps(record, ensure_ascii=False)
+    log.info(line)
+    if PERF_LOG:
+        try:
+            with open(PERF_LOG, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+        except OSError as e:
+            log.warning("perf log write failed: %s", e)
+    _current.set(None)
+    return record
+
+
+def finish_current():
+    # قبل قطع السكربت (st.rerun / st.stop) لا يصل إلى finish_run في آخره: نسجل الدورة الجارية الآن
+    run = _current.get()
+    if run is not None:
+        finish_run(run)
+
+
+@contextmanager
+def section(name, **extra):
+    run = _current.get()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if run is not None:
+            run.add(name, time.perf_counter() - start, **extra)
+
+
+def instrument(name):
+    # لجزء يعاد تشغيله وحده (st.fragment): داخل دورة كاملة يسجل كـ lap، ووحده يسجل دورة مستقلة
+    def wrap(fn):
+        @functools.wraps(fn)
+        def inner(*args, **kwargs):
+            own = _current.get() is None
+            run = start_run(name) if own else None
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                lap(name)
+                if own: finish_run(run)
+        return inner
+    return wrap
+
+
+def lap(name, **extra):
+    run = _current.get()
+    if run is not None:
+        run.lap(name, **extra)
+
+
+def frame(name, df):
+    # حجم جدول سيرسل للمتصفح (عدد الصفوف وحجمه في ذاكرة pandas)
+    run = _current.get()
+    if run is not None:
+        run.add_frame(name, df)
+    return df
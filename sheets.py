@@ -0,0 +1,344 @@
+import pandas as pd
+from datetime import datetime, date
+from gspread.exceptions import WorksheetNotFound
+from gspread.utils import rowcol_to_a1
+from ledger import reconcile, order_costs, STATUS_LIST
+from perf import section
+
+# --- أوراق Google Sheets: القراءة وتحويل الأنواع ---
+ORDERS_SHEET = "Sheet1"
+PAYMENTS_SHEET = "payments"
+# الأرشيف: الطلبات المسددة بالكامل ودفعاتها بنفس الأعمدة + مجاميع سنوية محفوظة مسبقاً
+ARCHIVE_ORDERS_SHEET = "archive_orders"
+ARCHIVE_PAYMENTS_SHEET = "archive_payments"
+ARCHIVE_TOTALS_SHEET = "archive_totals"
+
+# --- مخطط الورقتين: نوع كل عمود يحدد طريقة قراءته وتمثيله في الذاكرة ---
+# id: رقم صحيح صغير | num: رقم | category: قيم متكررة قليلة (الحالة/المورد) | text: نص | date: تاريخ بصيغة DATE_FORMAT
+DATE_FORMAT = "%Y-%m-%d"
+ORDERS_SCHEMA = {
+    "ID": "id", "الطلبية": "text", "المورد": "category", "القيمة_دولار": "num", "سعر_الصرف": "num",
+    "قيمة_البضاعة_ريال": "num", "رسوم_شحن_تخليص": "num", "اجمالي_التكلفة": "num",
+    "المدفوع": "num", "المتبقي": "num", "الحالة": "category", "ملاحظات": "text",
+    "نسبة_اعتماد": "num", "نسبة_شحن": "num", "نسبة_وصول": "num",
+    "تاريخ_الاعتماد_الفعلي": "date", "تاريخ_الشحن_المتوقع": "date",
+    "تاريخ_الشحن_الفعلي": "date", "تاريخ_الوصول_المتوقع": "date", "تاريخ_الوصول_الفعلي": "date",
+}
+PAYMENTS_SCHEMA = {"PaymentID": "id", "OrderID": "id", "التاريخ": "text", "المبلغ": "num", "البيان": "text", "رابط_السند": "text"}
+TOTALS_SCHEMA = {"السنة": "id", "count": "num", "total": "num", "paid": "num"}
+CATEGORIES = {"الحالة": STATUS_LIST}   # فئات معروفة مسبقاً (وما يظهر غيرها في الورقة يضاف بعدها)
+ID_DTYPE = "int32"
+
+ORD_COLS = list(ORDERS_SCHEMA)
+PAY_COLS = list(PAYMENTS_SCHEMA)
+TOTALS_COLS = list(TOTALS_SCHEMA)
+NUM_COLS = [c for c, kind in ORDERS_SCHEMA.items() if kind == "num"]
+DATE_COLS = [c for c, kind in ORDERS_SCHEMA.items() if kind == "date"]
+CATEGORY_COLS = [c for c, kind in ORDERS_SCHEMA.items() if kind == "category"]
+REPORT_COLS = ["الورقة", "الصف", "العمود", "القيمة"]
+
+
+def read_frames(conn, report=None):
+    # قراءة الورقتين من المصدر مباشرة (بدون كاش)
+    with section("sheets_read"):
+        df_orders = conn.read(worksheet=ORDERS_SHEET, ttl=0)
+        df_payments = _read_optional(conn, PAYMENTS_SHEET)
+    return prepare_frames(df_orders, df_payments, report)
+
+
+def read_archive(conn):
+    # أوراق الأرشيف تقرأ عند الطلب فقط (وقد لا تكون أنشئت بعد)
+    with section("archive_read"):
+        df_orders = _read_optional(conn, ARCHIVE_ORDERS_SHEET)
+        df_payments = _read_optional(conn, ARCHIVE_PAYMENTS_SHEET)
+    return prepare_frames(df_orders, df_payments)
+
+
+def read_totals(conn):
+    return parse_sheet(_read_optional(conn, ARCHIVE_TOTALS_SHEET), TOTALS_SCHEMA, ARCHIVE_TOTALS_SHEET)
+
+
+def _read_optional(conn, worksheet):
+    try:
+        return conn.read(worksheet=worksheet, ttl=0)
+    except Exception:
+        return pd.DataFrame()
+
+
+def prepare_frames(df_orders, df_payments, report=None):
+    with section("coerce", rows=len(df_orders) + len(df_payments)):
+        df_orders, df_payments = coerce_frames(df_orders, df_payments, report)
+    # حساب المدفوع والمتبقي لكل الطلبات بعملية واحدة
+    with section("reconcile"):
+        df_orders = reconcile(df_orders, df_payments)
+    return df_orders, df_payments
+
+
+def coerce_frames(df_orders, df_payments, report=None):
+    # report: قائمة تضاف إليها الخلايا غير الصالحة (انظر validation_report)
+    return (parse_sheet(df_orders, ORDERS_SCHEMA, ORDERS_SHEET, report),
+            parse_sheet(df_payments, PAYMENTS_SCHEMA, PAYMENTS_SHEET, report))
+
+
+def parse_sheet(raw, schema, sheet, report=None):
+    # تمريرة واحدة على أعمدة المخطط تبني إطاراً جديداً (بدون تعديل raw)
+    # إصلاح الهمزة في أسماء الأعمدة: إجمالي -> اجمالي
+    source = {str(c).replace('إجمالي', 'اجمالي'): c for c in raw.columns}
+    columns = {}
+    for col, kind in schema.items():
+        values = raw[source[col]] if col in source else pd.Series(None, index=raw.index, dtype=object)
+        columns[col], bad = _parse(values, kind, CATEGORIES.get(col))
+        if report is not None and bad.any():
+            report.append(pd.DataFrame({
+                "الورقة": sheet, "الصف": raw.index[bad] + 2, "العمود": col, "القيمة": values[bad].astype(str),
+            }))
+    # أعمدة إضافية في الورقة خارج المخطط تبقى كما هي
+    for col, name in source.items():
+        if col not in schema: columns[col] = raw[name]
+    return pd.DataFrame(columns, index=raw.index)
+
+
+def _parse(values, kind, categories=None):
+    # ترجع (العمود المحول، قناع الخلايا غير الفارغة التي تعذر تحويلها)
+    # الخلايا الفارغة تصبح 0/NaT كما كانت ولا تعد أخطاء
+    if kind in ("id", "num"):
+        if pd.api.types.is_numeric_dtype(values):
+            parsed, bad = values, pd.Series(False, index=values.index)
+        else:
+            try:
+                # المسار السريع: كل الخلايا أرقام أو فارغة
+                parsed, bad = values.astype(float), pd.Series(False, index=values.index)
+            except (ValueError, TypeError):
+                parsed = pd.to_numeric(values, errors='coerce')
+                bad = _failed(values, parsed)
+        parsed = parsed.fillna(0)
+        return (parsed.astype(ID_DTYPE) if kind == "id" else parsed.astype(float)), bad
+    if kind == "date":
+        parsed = pd.to_datetime(values, format=DATE_FORMAT, errors='coerce')
+        bad = _failed(values, parsed)
+        if bad.any():
+            # صيغ أخرى يدخلها المستخدم في الورقة يدوياً (المسار البطيء للقلة فقط)
+            parsed[bad] = pd.to_datetime(values[bad], format="mixed", errors='coerce')
+            bad &= parsed.isna()
+        return parsed, bad
+    # النصوص كنصوص فقط (الخلايا الرقمية في الورقة تصل كأرقام) حتى تصلح للحفظ كـ Parquet
+    text = values if pd.api.types.is_string_dtype(values) and values.dtype != object else values.where(values.isna(), values.astype(str))
+    if kind == "category":
+        known = list(categories or [])
+        extra = sorted(set(text.dropna().unique()) - set(known))
+        text = pd.Categorical(text, categories=known + extra)
+    return text, pd.Series(False, index=values.index)
+
+
+def _failed(values, parsed):
+    # خلايا لم تتحول وليست فارغة في الورقة (نفحص النص للخلايا الناقصة فقط)
+    failed = parsed.isna()
+    if failed.any():
+        missing = values[failed]
+        failed[failed] = missing.notna() & missing.astype(str).str.strip().ne("")
+    return failed
+
+
+def validation_report(parts):
+    # الخلايا التي أصبحت 0/NaT لأن قيمتها في الورقة غير صالحة (الورقة، رقم الصف، العمود، القيمة الأصلية)
+    if not parts:
+        return pd.DataFrame(columns=REPORT_COLS)
+    return pd.concat(parts, ignore_index=True)
+
+
+def append_frame(df, rows):
+    # إضافة صفوف مع الحفاظ على الأنواع المضغوطة (concat يرجع الفئات إلى object عند اختلافها)
+    out = pd.concat([df, rows], ignore_index=True)
+    for col, dtype in df.dtypes.items():
+        if out[col].dtype == dtype: continue
+        if isinstance(dtype, pd.CategoricalDtype):
+            dtype = pd.CategoricalDtype(dtype.categories.union(pd.Index(out[col].dropna().unique()), sort=False))
+        out[col] = out[col].astype(dtype)
+    return out
+
+
+# --- الكتابة بالفرق (delta): إضافة صفوف وتعديل خلايا بدلاً من إعادة كتابة الورقة ---
+# تكلفة الحفظ تتبع حجم التغيير لا حجم الجدول.
+
+def _worksheet(conn, name, create=None):
+    # كائن gspread للورقة (متاح مع حساب الخدمة فقط، وهو نفسه المطلوب لـ conn.update)
+    # create: عدد الأعمدة لإنشاء الورقة إن لم توجد (أوراق الأرشيف تنشأ مع أول نقل)
+    try:
+        return conn.client._select_worksheet(worksheet=name)
+    except WorksheetNotFound:
+        if not create: raise
+        return conn.client._open_spreadsheet().add_worksheet(title=name, rows=1, cols=create)
+
+
+def _cell(value):
+    if value is None: return ""
+    if isinstance(value, (pd.Timestamp, datetime, date)):
+        return "" if pd.isna(value) else value.strftime("%Y-%m-%d")
+    if pd.api.types.is_scalar(value) and pd.isna(value): return ""
+    if hasattr(value, "item"): return value.item()   # أنواع numpy
+    return value
+
+
+def _header(ws, columns):
+    # خريطة اسم العمود -> رقم العمود في الورقة، مع إضافة الأعمدة الناقصة في آخر الصف الأول
+    header = [h.replace('إجمالي', 'اجمالي') for h in ws.row_values(1)]
+    missing = [c for c in columns if c not in header]
+    if missing:
+        start = len(header) + 1
+        ws.update(range_name=rowcol_to_a1(1, start), values=[missing])
+        header += missing
+    return {name: i + 1 for i, name in enumerate(header) if name}
+
+
+def append_rows(conn, worksheet, df):
+    # إضافة صفوف جديدة في آخر الورقة بطلب واحد
+    if df.empty: return
+    ws = _worksheet(conn, worksheet, create=len(df.columns))
+    cols = _header(ws, list(df.columns))
+    width = max(cols.values())
+    values = []
+    for rec in df.to_dict("records"):
+        row = [""] * width
+        for name, val in rec.items():
+            row[cols[name] - 1] = _cell(val)
+        values.append(row)
+    ws.append_rows(values, value_input_option="USER_ENTERED", table_range="A1")
+
+
+def _locate_rows(ws, cols, ids, key, hints):
+    # رقم الصف لكل ID: نتحقق من الموضع المتوقع بطلب واحد، ونقرأ عمود المفتاح فقط إن لم يطابق
+    key_col = cols[key]
+    found = {}
+    if hints:
+        probe = [i for i in ids if i in hints]
+        cells = ws.batch_get([rowcol_to_a1(hints[i], key_col) for i in probe]) if probe else []
+        for i, cell in zip(probe, cells):
+            got = cell[0][0] if cell and cell[0] else ""
+            if str(got).split(".")[0] == str(i):
+                found[i] = hints[i]
+    rest = [i for i in ids if i not in found]
+    if rest:
+        column = ws.col_values(key_col)
+        rows = {str(v).split(".")[0]: n + 1 for n, v in enumerate(column) if n > 0}
+        for i in rest:
+            if str(i) in rows: found[i] = rows[str(i)]
+    return found
+
+
+def patch_rows(conn, worksheet, changes, key="ID", hints=None):
+    # changes: {ID: {العمود: القيمة}} — ترسل الخلايا المتغيرة فقط
+    # hints: {ID: رقم الصف المتوقع} من ترتيب البيانات المحملة
+    if not changes: return []
+    ws = _worksheet(conn, worksheet)
+    columns = sorted({c for row in changes.values() for c in row})
+    cols = _header(ws, columns + [key])
+    rows = _locate_rows(ws, cols, list(changes), key, hints)
+    data = []
+    for oid, row_changes in changes.items():
+        if oid not in rows: continue
+        for name, val in row_changes.items():
+            data.append({"range": rowcol_to_a1(rows[oid], cols[name]), "values": [[_cell(val)]]})
+    if data:
+        ws.batch_update(data, value_input_option="USER_ENTERED")
+    return [oid for oid in changes if oid not in rows]   # معرفات لم توجد في الورقة
+
+
+def read_cells(conn, worksheet, ids, columns, key="ID", hints=None):
+    # القيم الحالية لخلايا محددة بطلب واحد: {ID: {العمود: القيمة}} — الصفوف غير الموجودة لا ترجع
+    if not ids: return {}
+    ws = _worksheet(conn, worksheet)
+    cols = _header(ws, list(columns) + [key])
+    rows = _locate_rows(ws, cols, list(ids), key, hints)
+    cells = [(oid, c) for oid in ids if oid in rows for c in columns]
+    values = ws.batch_get([rowcol_to_a1(rows[oid], cols[c]) for oid, c in cells]) if cells else []
+    out = {oid: {} for oid in rows}
+    for (oid, c), cell in zip(cells, values):
+        out[oid][c] = cell[0][0] if cell and cell[0] else ""
+    return out
+
+
+def delete_rows(conn, worksheet, ids, key="ID", hints=None):
+    if not ids: return
+    ws = _worksheet(conn, worksheet)
+    cols = _header(ws, [key])
+    rows = _locate_rows(ws, cols, list(ids), key, hints)
+    if not rows: return
+    # كل الصفوف بطلب واحد: الصفوف المتتالية نطاق واحد، والنطاقات من الأسفل للأعلى حتى لا تتزحزح أرقامها
+    requests = [{"deleteDimension": {"range": {"sheetId": ws.id, "dimension": "ROWS", "startIndex": first - 1, "endIndex": last}}}
+                for first, last in _row_runs(rows.values())]
+    ws.spreadsheet.batch_update({"requests": requests})
+
+
+def _row_runs(rows):
+    # (أول صف، آخر صف) لكل مجموعة صفوف متتالية، من الأسفل للأعلى
+    runs = []
+    for row in sorted(set(rows), reverse=True):
+        if runs and runs[-1][0] == row + 1:
+            runs[-1][0] = row
+        else:
+            runs.append([row, row])
+    return [tuple(run) for run in runs]
+
+
+def row_hints(df, key="ID"):
+    # الصف في الورقة = موضع الصف في الإطار المحمل + 2 (صف العناوين)
+    return {int(k): int(i) + 2 for i, k in zip(df.index, df[key])}
+
+
+COST_INPUTS = ["القيمة_دولار", "سعر_الصرف", "المدفوع"]
+
+
+def _num(value):
+    value = pd.to_numeric(value, errors='coerce')
+    return 0.0 if pd.isna(value) else float(value)
+
+
+def editor_delta(df_orders, editor_state, fees_factor, next_id=None):
+    # تحويل حالة st.data_editor (edited_rows/added_rows/deleted_rows) إلى تغييرات بالـ ID
+    # المواضع في الحالة تشير إلى ترتيب df_orders كما عُرض في المحرر
+    changes = {}
+    for pos, cols in editor_state.get("edited_rows", {}).items():
+        base = df_orders.iloc[int(pos)]
+        row = dict(cols)
+        if any(c in COST_INPUTS for c in cols):
+            merged = {c: _num(cols.get(c, base[c])) for c in COST_INPUTS}
+            row.update(order_costs(merged["القيمة_دولار"], merged["سعر_الصرف"], merged["المدفوع"], fees_factor))
+        changes[int(base['ID'])] = row
+
+    added = pd.DataFrame(editor_state.get("added_rows", []), columns=ORD_COLS)
+    if not added.empty:
+        start = next_id or (int(df_orders['ID'].max()) + 1 if not df_orders.empty else 1)
+        added['ID'] = range(start, start + len(added))
+        for col in COST_INPUTS:
+            added[col] = pd.to_numeric(added[col], errors='coerce').fillna(0)
+        for col, vals in order_costs(added["القيمة_دولار"], added["سعر_الصرف"], added["المدفوع"], fees_factor).items():
+            added[col] = vals
+
+    deleted = [int(df_orders['ID'].iloc[int(pos)]) for pos in editor_state.get("deleted_rows", [])]
+    for oid in deleted: changes.pop(oid, None)
+    return changes, added, deleted
+
+
+def edited_before(df_orders, editor_state):
+    # القيم الأصلية للخلايا التي عدلها المستخدم في المحرر: {ID: {العمود: القيمة}}
+    before = {}
+    for pos, cols in editor_state.get("edited_rows", {}).items():
+        base = df_orders.iloc[int(pos)]
+        before[int(base['ID'])] = {c: base[c] for c in cols}
+    return before
+
+
+def apply_changes(df, changes, added=None, deleted=(), key="ID"):
+    # نفس التغييرات على الإطار المحمل (نسخة) ليعرض الحفظ قبل وصوله للمصدر
+    # بعد الحذف يعاد الترقيم حتى يبقى الفهرس = موضع الصف في الورقة (row_hints)
+    df = df[~df[key].isin(deleted)].reset_index(drop=True) if len(deleted) else df.copy()
+    index_of = dict(zip(df[key], df.index))
+    for oid, row in changes.items():
+        if oid not in index_of: continue
+        for col, value in row.items():
+            if isinstance(df[col].dtype, pd.CategoricalDtype) and not pd.isna(value) and value not in df[col].cat.categories:
+                df[col] = df[col].cat.add_categories([value])
+            df.at[index_of[oid], col] = value
+    if added is not None and not added.empty:
+        df = append_frame(df, added)
+    return df
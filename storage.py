@@ -0,0 +1,317 @@
+import os
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+import pandas as pd
+from gspread.exceptions import WorksheetNotFound
+from archive import ARCHIVE_TABLES, split_archive, yearly_totals, totals_changes, TOTAL_VALUES
+from ledger import StatusSummary, payment_index, payments_of, reconcile, CLOSED_STATUSES
+from perf import section
+from sheets import (
+    read_frames, read_archive, read_totals, prepare_frames, parse_sheet, validation_report,
+    append_rows, patch_rows, delete_rows, read_cells, row_hints, _cell,
+    ORDERS_SHEET, PAYMENTS_SHEET, ARCHIVE_ORDERS_SHEET, ARCHIVE_PAYMENTS_SHEET, ARCHIVE_TOTALS_SHEET,
+    ORDERS_SCHEMA, PAYMENTS_SCHEMA, TOTALS_SCHEMA, ORD_COLS, PAY_COLS, TOTALS_COLS,
+)
+
+# --- طبقة التخزين: نفس العمليات فوق Google Sheets أو قاعدة SQLite محلية ---
+# الجداول المنطقية: "orders" و "payments"، وأرشيفهما "orders_archive" و "payments_archive"
+# ومجاميع الأرشيف السنوية "archive_totals"
+KEYS = {
+    "orders": "ID", "payments": "PaymentID",
+    "orders_archive": "ID", "payments_archive": "PaymentID", "archive_totals": "السنة",
+}
+
+
+class Store(ABC):
+    cache = None   # كاش الإطارات المحملة (SheetCache) إن وجد
+    issues = None  # تقرير الخلايا غير الصالحة من آخر تحميل (validation_report)
+    totals = None  # مجاميع الأرشيف السنوية من آخر تحميل (تقرأ في الخلفية مع الإطارات)
+
+    @abstractmethod
+    def load(self):
+        ...
+
+    @abstractmethod
+    def append(self, table, df):
+        ...
+
+    @abstractmethod
+    def patch(self, table, changes, hints=None):
+        # changes: {المفتاح: {العمود: القيمة}} — ترجع المفاتيح غير الموجودة
+        ...
+
+    @abstractmethod
+    def delete(self, table, ids, hints=None):
+        ...
+
+    @abstractmethod
+    def next_id(self, table):
+        ...
+
+    def reserve_ids(self, table, n=1):
+        # أول رقم لكتلة من n صفوف جديدة (الطابور WriteQueue يحجز بدون تداخل بين المستخدمين)
+        return self.next_id(table)
+
+    @abstractmethod
+    def read_cells(self, table, ids, columns, hints=None):
+        # القيم الحالية في المصدر: {المفتاح: {العمود: القيمة}} للتحقق قبل الكتابة
+        ...
+
+    # --- الاستعلامات التجميعية (افتراضياً على الإطارات المحملة في الكاش) ---
+    def summary(self):
+        # ملخص الحالات/الموردين/الأشهر — يُبنى مرة لكل نسخة من الكاش ويُحدث في مكانه بعد الحفظ
+        if self.cache is not None:
+            if not self.cache.loaded():
+                # المصدر غير متاح وبدون نسخة محلية: الخطأ يعرض عند التحميل، والكروت تظهر أصفاراً
+                return StatusSummary.build(pd.DataFrame())
+            return self.cache.derived("summary", lambda df_orders, df_payments: StatusSummary.build(df_orders))
+        return StatusSummary.build(self.load()[0])
+
+    def status_totals(self):
+        return self.summary().by_status()
+
+    def payment_history(self, order_id):
+        if self.cache is not None:
+            df_payments = self.cache.peek()[1]
+            index = self.cache.derived("payment_index", lambda df_orders, df_payments: payment_index(df_payments))
+        else:
+            df_payments = self.load()[1]
+            index = payment_index(df_payments)
+        return payments_of(df_payments, index, order_id)
+
+    # --- الأرشيف: لا يحمل مع البيانات النشطة ---
+    @abstractmethod
+    def load_archive(self):
+        # (الطلبات، الدفعات) المؤرشفة — عند الطلب فقط
+        ...
+
+    @abstractmethod
+    def load_archive_totals(self):
+        ...
+
+    def archive_totals(self):
+        # المجاميع السنوية المحفوظة للأرشيف — مع الكاش من آخر تحميل في الخلفية، فتتغير مع الإطارات النشطة معاً
+        # (بعد الأرشفة لا تسبق المجاميع الجديدة حذف الطلبات من الإطارات فتحسب مرتين)
+        if self.cache is not None:
+            return self.totals if self.totals is not None else pd.DataFrame(columns=TOTALS_COLS)
+        return self.load_archive_totals()
+
+    def archive(self, df_orders, df_payments, ids):
+        # نقل طلبات مسددة ودفعاتها من الجزء النشط إلى الأرشيف، ترجع عدد الطلبات المنقولة
+        # (يستدعى بعد flush لطابور الكتابة حتى لا تصل تعديلات معلقة لصفوف نقلت)
+        ids = self._still_closed(ids, row_hints(df_orders))
+        orders, payments = split_archive(df_orders, df_payments, ids)
+        if orders.empty: return 0
+        # الإضافة للأرشيف ثم الحذف من النشط ثم المجاميع: الانقطاع في المنتصف يترك نسخة مكررة لا صفوفاً مفقودة،
+        # وإعادة النقل لا تضيف ما وصل الأرشيف في محاولة سابقة
+        arc_orders, arc_payments = self.load_archive()
+        self.append(ARCHIVE_TABLES["orders"], orders.loc[~orders['ID'].isin(arc_orders['ID']), ORD_COLS])
+        self.append(ARCHIVE_TABLES["payments"], payments.loc[~payments['PaymentID'].isin(arc_payments['PaymentID']), PAY_COLS])
+        self.delete("payments", payments['PaymentID'].tolist(), hints=row_hints(df_payments, "PaymentID"))
+        self.delete("orders", orders['ID'].tolist(), hints=row_hints(df_orders))
+        # المجاميع تعاد من محتوى الأرشيف (لا تجمع فوق المحفوظة) فلا تحسب طلبية مرتين؛ والمدفوع من كل دفعاتها
+        # (بعد انقطاع سابق قد تكون دفعاتها حذفت من النشط فيقرأ مدفوعها 0)
+        archived = pd.concat([arc_orders, orders[~orders['ID'].isin(arc_orders['ID'])]], ignore_index=True)
+        arc_payments = pd.concat([arc_payments, payments[~payments['PaymentID'].isin(arc_payments['PaymentID'])]], ignore_index=True)
+        archived = reconcile(archived, arc_payments)
+        changes, new_rows = totals_changes(self.load_archive_totals(), yearly_totals(archived))
+        self.patch("archive_totals", changes)
+        self.append("archive_totals", new_rows)
+        return len(orders)
+
+    def _still_closed(self, ids, hints=None):
+        # الحالة في المصدر وقت النقل (قد يكون غيرها مستخدم آخر بعد التحميل)
+        current = self.read_cells("orders", ids, ["الحالة"], hints=hints)
+        return [i for i in ids if current.get(i, {}).get("الحالة") in CLOSED_STATUSES]
+
+
+class GSheetsStore(Store):
+    SHEETS = {
+        "orders": ORDERS_SHEET, "payments": PAYMENTS_SHEET,
+        "orders_archive": ARCHIVE_ORDERS_SHEET, "payments_archive": ARCHIVE_PAYMENTS_SHEET,
+        "archive_totals": ARCHIVE_TOTALS_SHEET,
+    }
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def load(self):
+        report = []
+        frames = read_frames(self.conn, report)
+        self.issues = validation_report(report)
+        self.totals = self.load_archive_totals()
+        return frames
+
+    def append(self, table, df):
+        append_rows(self.conn, self.SHEETS[table], df)
+
+    def patch(self, table, changes, hints=None):
+        return patch_rows(self.conn, self.SHEETS[table], changes, key=KEYS[table], hints=hints)
+
+    def delete(self, table, ids, hints=None):
+        delete_rows(self.conn, self.SHEETS[table], ids, key=KEYS[table], hints=hints)
+
+    def read_cells(self, table, ids, columns, hints=None):
+        return read_cells(self.conn, self.SHEETS[table], ids, columns, key=KEYS[table], hints=hints)
+
+    def next_id(self, table):
+        # نقرأ عمود المفتاح فقط من الورقة (وليس من البيانات المحملة قد تكون قديمة)
+        # والأرقام المؤرشفة لا يعاد استخدامها
+        tables = [table] + ([ARCHIVE_TABLES[table]] if table in ARCHIVE_TABLES else [])
+        return max(self._max_id(t) for t in tables) + 1
+
+    def _max_id(self, table):
+        try:
+            ws = self.conn.client._select_worksheet(worksheet=self.SHEETS[table])
+        except WorksheetNotFound:
+            return 0
+        header = ws.row_values(1)
+        if KEYS[table] not in header:
+            return 0
+        ids = pd.to_numeric(pd.Series(ws.col_values(header.index(KEYS[table]) + 1)[1:], dtype=object), errors='coerce')
+        return int(ids.max()) if ids.notna().any() else 0
+
+    def load_archive(self):
+        return read_archive(self.conn)
+
+    def load_archive_totals(self):
+        return read_totals(self.conn)
+
+
+class SQLiteStore(Store):
+    SCHEMAS = {
+        "orders": ORDERS_SCHEMA, "payments": PAYMENTS_SCHEMA,
+        "orders_archive": ORDERS_SCHEMA, "payments_archive": PAYMENTS_SCHEMA,
+        "archive_totals": TOTALS_SCHEMA,
+    }
+    COLUMNS = {table: list(schema) for table, schema in SCHEMAS.items()}
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._init_schema()
+
+    @contextmanager
+    def _connect(self):
+        # اتصال لكل عملية: المعاملة تحفظ عند النجاح والاتصال يغلق دائماً (سياق sqlite3 وحده لا يغلق)
+        db = sqlite3.connect(self.path)
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    def _init_schema(self):
+        def col_type(table, col, kind):
+            if col == KEYS[table]: return "INTEGER PRIMARY KEY"
+            return {"id": "INTEGER", "num": "REAL"}.get(kind, "TEXT")
+
+        with self._connect() as db:
+            for table, schema in self.SCHEMAS.items():
+                db.execute(f'CREATE TABLE IF NOT EXISTS {table} ({", ".join(f"{_q(c)} {col_type(table, c, k)}" for c, k in schema.items())})')
+            db.execute('CREATE INDEX IF NOT EXISTS idx_payments_order ON payments (OrderID)')
+            db.execute('CREATE INDEX IF NOT EXISTS idx_payments_archive_order ON payments_archive (OrderID)')
+
+    def load(self):
+        with section("sqlite_read"), self._connect() as db:
+            df_orders = pd.read_sql_query("SELECT * FROM orders ORDER BY ID", db)
+            df_payments = pd.read_sql_query("SELECT * FROM payments ORDER BY PaymentID", db)
+        report = []
+        frames = prepare_frames(df_orders, df_payments, report)
+        self.issues = validation_report(report)
+        self.totals = self.load_archive_totals()
+        return frames
+
+    def append(self, table, df):
+        if df.empty: return
+        cols = [c for c in self.COLUMNS[table] if c in df.columns]
+        rows = [tuple(_cell(v) if not _blank(v) else None for v in rec) for rec in df[cols].itertuples(index=False)]
+        sql = f'INSERT INTO {table} ({", ".join(map(_q, cols))}) VALUES ({", ".join("?" * len(cols))})'
+        with self._lock, self._connect() as db:
+            db.executemany(sql, rows)
+
+    def patch(self, table, changes, hints=None):
+        key = KEYS[table]
+        missing = []
+        with self._lock, self._connect() as db:
+            for oid, row in changes.items():
+                if not row: continue
+                sets = ", ".join(f"{_q(c)} = ?" for c in row)
+                values = [None if _blank(v) else _cell(v) for v in row.values()]
+                cur = db.execute(f'UPDATE {table} SET {sets} WHERE {key} = ?', values + [oid])
+                if cur.rowcount == 0: missing.append(oid)
+        return missing
+
+    def delete(self, table, ids, hints=None):
+        if not ids: return
+        with self._lock, self._connect() as db:
+            db.executemany(f'DELETE FROM {table} WHERE {KEYS[table]} = ?', [(int(i),) for i in ids])
+
+    def read_cells(self, table, ids, columns, hints=None):
+        if not ids: return {}
+        key = KEYS[table]
+        sql = f'SELECT {", ".join([key] + list(map(_q, columns)))} FROM {table} WHERE {key} IN ({", ".join("?" * len(ids))})'
+        with self._connect() as db:
+            rows = db.execute(sql, [int(i) for i in ids]).fetchall()
+        return {row[0]: dict(zip(columns, row[1:])) for row in rows}
+
+    def next_id(self, table):
+        # والأرقام المؤرشفة لا يعاد استخدامها
+        key = KEYS[table]
+        source = f'SELECT {key} FROM {table}'
+        if table in ARCHIVE_TABLES:
+            source += f' UNION ALL SELECT {key} FROM {ARCHIVE_TABLES[table]}'
+        with self._connect() as db:
+            return db.execute(f'SELECT COALESCE(MAX({key}), 0) + 1 FROM ({source})').fetchone()[0]
+
+    def load_archive(self):
+        with section("sqlite_archive_read"), self._connect() as db:
+            df_orders = pd.read_sql_query("SELECT * FROM orders_archive ORDER BY ID", db)
+            df_payments = pd.read_sql_query("SELECT * FROM payments_archive ORDER BY PaymentID", db)
+        return prepare_frames(df_orders, df_payments)
+
+    def load_archive_totals(self):
+        with self._connect() as db:
+            raw = pd.read_sql_query(f'SELECT * FROM archive_totals ORDER BY {_q("السنة")}', db)
+        return parse_sheet(raw, TOTALS_SCHEMA, "archive_totals")
+
+    def archive(self, df_orders, df_payments, ids):
+        # في قاعدة واحدة: النقل والمجاميع والحذف في معاملة واحدة (INSERT ... SELECT بدون المرور بالإطارات)
+        ids = self._still_closed(ids)
+        if not ids: return 0
+        totals = yearly_totals(df_orders[df_orders['ID'].isin(ids)])
+        marks = ", ".join("?" * len(ids))
+        year = _q("السنة")
+        upsert = (f'INSERT INTO archive_totals ({", ".join(map(_q, TOTALS_COLS))}) VALUES (?, ?, ?, ?) '
+                  f'ON CONFLICT({year}) DO UPDATE SET ' + ", ".join(f"{c} = {c} + excluded.{c}" for c in TOTAL_VALUES))
+        with self._lock, self._connect() as db:
+            for table, where in (("orders", "ID"), ("payments", "OrderID")):
+                cols = ", ".join(map(_q, self.COLUMNS[table]))
+                db.execute(f'INSERT INTO {ARCHIVE_TABLES[table]} ({cols}) SELECT {cols} FROM {table} WHERE {where} IN ({marks})', ids)
+            db.executemany(upsert, [(int(r["السنة"]), r["count"], r["total"], r["paid"]) for r in totals.to_dict("records")])
+            db.execute(f'DELETE FROM payments WHERE OrderID IN ({marks})', ids)
+            db.execute(f'DELETE FROM orders WHERE ID IN ({marks})', ids)
+        return len(ids)
+
+    def seed(self, df_orders, df_payments):
+        # نسخ بيانات موجودة (مثلاً من Google Sheets) إلى قاعدة فارغة
+        self.append("orders", df_orders)
+        self.append("payments", df_payments)
+
+
+def _q(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _blank(value):
+    return value is None or (pd.api.types.is_scalar(value) and pd.isna(value)) or value == ""
+
+
+def open_store(settings, conn_factory):
+    # settings: قسم [storage] من secrets (backend = "gsheets" | "sqlite", path = ...)
+    backend = os.environ.get("SHAN_STORAGE") or settings.get("backend", "gsheets")
+    if backend == "sqlite":
+        return SQLiteStore(os.environ.get("SHAN_SQLITE_PATH") or settings.get("path", "shan.db"))
+    return GSheetsStore(conn_factory())
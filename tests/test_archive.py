@@ -0,0 +1,111 @@
+import pandas as pd
+import pytest
+from archive import totals_changes, yearly_totals, archive_candidates
+from sheets import TOTALS_COLS
+from storage import Store, SQLiteStore
+
+
+class StepStore(SQLiteStore):
+    # النقل خطوة بخطوة كما في Google Sheets (بدون معاملة واحدة)، ويمكن إفشال حذف لمحاكاة الانقطاع
+    archive = Store.archive
+
+    def __init__(self, path):
+        super().__init__(path)
+        self.fail_delete = None
+
+    def delete(self, table, ids, hints=None):
+        if table == self.fail_delete:
+            self.fail_delete = None
+            raise RuntimeError("interrupted")
+        super().delete(table, ids, hints)
+
+
+def seed(store):
+    store.append("orders", pd.DataFrame({
+        "ID": [1, 2, 3], "الطلبية": ["أ", "ب", "ج"], "الحالة": ["مسددة بالكامل", "مسددة بالكامل", "تم الشحن"],
+        "اجمالي_التكلفة": [100.0, 200.0, 300.0], "المدفوع": [100.0, 200.0, 50.0],
+        "تاريخ_الاعتماد_الفعلي": ["2025-03-01", "2026-02-01", "2026-02-01"],
+    }))
+    store.append("payments", pd.DataFrame({
+        "PaymentID": [1, 2, 3, 4], "OrderID": [1, 2, 2, 3], "التاريخ": "2026-01-01", "المبلغ": [100.0, 150.0, 50.0, 50.0],
+    }))
+    return store.load()
+
+
+def state(store):
+    arc_orders, arc_payments = store.load_archive()
+    df_orders, df_payments = store.load()
+    totals = store.load_archive_totals()
+    return (sorted(arc_orders['ID']), sorted(arc_payments['PaymentID']), sorted(df_orders['ID']), sorted(df_payments['PaymentID']),
+            totals[TOTALS_COLS].values.tolist())
+
+
+ARCHIVED = ([1, 2], [1, 2, 3], [3], [4], [[2025, 1.0, 100.0, 100.0], [2026, 1.0, 200.0, 200.0]])
+
+
+@pytest.fixture(params=[StepStore, SQLiteStore])
+def store(request, tmp_path):
+    return request.param(str(tmp_path / "shan.db"))
+
+
+def test_archive_candidates(store):
+    df_orders, _ = seed(store)
+    assert archive_candidates(df_orders, "2026-06-01") == [1, 2]
+
+
+def test_repeated_archive_is_a_no_op(store):
+    df_orders, df_payments = seed(store)
+    assert store.archive(df_orders, df_payments, [1, 2]) == 2
+    assert state(store) == ARCHIVED
+    # نفس الإطارات القديمة (مستخدم لم يحدث صفحته): لا شيء يتكرر
+    assert store.archive(df_orders, df_payments, [1, 2]) == 0
+    assert state(store) == ARCHIVED
+
+
+@pytest.mark.parametrize("table", ["payments", "orders"])
+def test_interrupted_archive_resumes_without_duplicates(tmp_path, table):
+    store = StepStore(str(tmp_path / "shan.db"))
+    df_orders, df_payments = seed(store)
+    store.fail_delete = table
+    with pytest.raises(RuntimeError):
+        store.archive(df_orders, df_payments, [1, 2])
+    # الانقطاع يترك نسخة في الأرشيف والطلبات ما زالت نشطة — إعادة النقل تكمل بدون تكرار
+    df_orders, df_payments = store.load()
+    assert store.archive(df_orders, df_payments, [1, 2]) == 2
+    assert state(store) == ARCHIVED
+
+
+def test_archive_in_batches_rebuilds_year_totals(tmp_path):
+    store = StepStore(str(tmp_path / "shan.db"))
+    df_orders, df_payments = seed(store)
+    store.archive(df_orders, df_payments, [1])
+    df_orders, df_payments = store.load()
+    store.archive(df_orders, df_payments, [2])
+    assert state(store) == ARCHIVED
+
+
+def totals(*rows):
+    return pd.DataFrame(rows, columns=TOTALS_COLS)
+
+
+@pytest.mark.parametrize("current, computed, changes, new_years", [
+    # نفس محتوى الأرشيف: لا تعديل (لا تجمع فوق المحفوظ)
+    (totals((2025, 2, 300.0, 300.0)), totals((2025, 2, 300.0, 300.0)), {}, []),
+    # المحسوب من الأرشيف يستبدل المحفوظ
+    (totals((2025, 1, 100.0, 100.0)), totals((2025, 2, 300.0, 300.0)), {2025: {"count": 2, "total": 300.0, "paid": 300.0}}, []),
+    (totals(), totals((2026, 1, 50.0, 50.0)), {}, [2026]),
+    # سنة مكررة في الورقة (إضافة سابقة انقطعت): تقارن بأول صف
+    (totals((2025, 2, 300.0, 300.0), (2025, 2, 300.0, 300.0)), totals((2025, 2, 300.0, 300.0)), {}, []),
+])
+def test_totals_changes_rebuild(current, computed, changes, new_years):
+    got_changes, new_rows = totals_changes(current, computed)
+    assert got_changes == changes
+    assert new_rows["السنة"].tolist() == new_years
+
+
+def test_yearly_totals_by_approval_year():
+    df = pd.DataFrame({"الحالة": "مسددة بالكامل", "المورد": "م",
+                       "اجمالي_التكلفة": [100.0, 200.0, 50.0], "المدفوع": [100.0, 200.0, 50.0],
+                       "تاريخ_الاعتماد_الفعلي": pd.to_datetime(["2025-03-01", "2025-12-31", None]),
+                       "تاريخ_الوصول_المتوقع": pd.to_datetime([None, None, None])})
+    assert yearly_totals(df).values.tolist() == [[0, 1.0, 50.0, 50.0], [2025, 2.0, 300.0, 300.0]]
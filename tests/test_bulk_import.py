@@ -0,0 +1,116 @@
+import io
+import pandas as pd
+import pytest
+from openpyxl import Workbook
+from bulk_import import plan_import, recheck_payments, commit_import, ORDER_DEFAULTS
+from ledger import FEES_FACTOR
+from storage import SQLiteStore
+from write_queue import WriteQueue
+
+ORDER_HEADER = ["الطلبية", "المورد", "القيمة_دولار", "سعر_الصرف", "الحالة"]
+# الصف 3 فارغ في الملف؛ الأخطاء في الصفوف 4 و6 و7
+ORDER_ROWS = [
+    ["طلبية أ", "مورد أ", "1000", "", ""],
+    None,
+    ["طلبية ب", "مورد أ", "abc", "3.75", ""],
+    ["طلبية ج", "مورد ب", "2000", "3.8", "تم الشحن"],
+    ["طلبية د", "مورد ب", "500", "3.75", "حالة غريبة"],
+    ["", "مورد ب", "500", "3.75", ""],
+]
+
+
+def csv_file(header, rows):
+    lines = [",".join(header)] + ["" if r is None else ",".join(r) for r in rows]
+    return io.BytesIO("\n".join(lines).encode("utf-8-sig"))
+
+
+def xlsx_file(header, rows):
+    wb = Workbook()
+    ws = wb.active
+    ws.append(header)
+    for n, row in enumerate(rows, start=2):
+        if row is not None:
+            for col, value in enumerate(row, start=1):
+                ws.cell(n, col, value if value != "" else None)
+    buf = io.BytesIO()
+    wb.save(buf)
+    buf.seek(0)
+    return buf
+
+
+@pytest.mark.parametrize("make, name", [(csv_file, "orders.csv"), (xlsx_file, "orders.xlsx")])
+def test_order_errors_report_file_rows(make, name):
+    rows, errors = plan_import(make(ORDER_HEADER, ORDER_ROWS), name, "orders", FEES_FACTOR, chunk_rows=2)
+    assert rows['الطلبية'].tolist() == ["طلبية أ", "طلبية ج"]
+    assert errors[["الصف", "العمود", "الخطأ"]].values.tolist() == [
+        [4, "القيمة_دولار", "قيمة غير صالحة"],
+        [6, "الحالة", "حالة غير معروفة"],
+        [7, "الطلبية", "اسم الطلبية مطلوب"],
+    ]
+
+
+def test_order_defaults_fill_missing_and_blank_cells():
+    rows, errors = plan_import(csv_file(["الطلبية", "القيمة_دولار", "سعر_الصرف"], [["أ", "100", ""]]), "o.csv", "orders", FEES_FACTOR)
+    assert errors.empty
+    row = rows.iloc[0]
+    for col, default in ORDER_DEFAULTS.items():
+        assert row[col] == default
+    assert row['قيمة_البضاعة_ريال'] == pytest.approx(375.0)
+    assert row['اجمالي_التكلفة'] == pytest.approx(375.0 + 100 * FEES_FACTOR)
+    assert row['المدفوع'] == 0.0
+
+
+@pytest.mark.parametrize("value, message", [
+    ("0", "القيمة يجب أن تكون أكبر من صفر"),
+    ("-5", "القيمة يجب أن تكون أكبر من صفر"),
+    ("x", "قيمة غير صالحة"),
+])
+def test_order_value_rejected(value, message):
+    rows, errors = plan_import(csv_file(ORDER_HEADER, [["أ", "م", value, "3.75", ""]]), "o.csv", "orders", FEES_FACTOR)
+    assert rows.empty
+    assert errors[["الصف", "الخطأ"]].values.tolist() == [[2, message]]
+
+
+def test_payment_rejections():
+    header = ["OrderID", "التاريخ", "المبلغ", "البيان"]
+    rows = [["1", "2026-01-01", "100", "أ"], ["9", "2026-01-01", "100", ""], None, ["1", "", "-5", ""], ["1", "", "x", ""]]
+    valid, errors = plan_import(csv_file(header, rows), "p.csv", "payments", FEES_FACTOR, order_ids=[1, 2])
+    assert valid['المبلغ'].tolist() == [100.0]
+    assert errors[["الصف", "العمود", "الخطأ"]].values.tolist() == [
+        [3, "OrderID", "رقم الطلبية غير موجود"],
+        [5, "المبلغ", "المبلغ يجب أن يكون أكبر من صفر"],
+        [6, "المبلغ", "قيمة غير صالحة"],
+    ]
+
+
+def test_recheck_payments_drops_orders_gone_since_plan():
+    rows = pd.DataFrame({"OrderID": [1, 2, 3], "المبلغ": [10.0, 20.0, 30.0]}, index=[0, 3, 4])
+    kept, errors = recheck_payments(rows, pd.Series([1, 3]))
+    assert kept['OrderID'].tolist() == [1, 3]
+    assert errors[["الصف", "العمود", "القيمة"]].values.tolist() == [[5, "OrderID", "2"]]
+
+
+def payments(n):
+    return pd.DataFrame({"PaymentID": None, "OrderID": 1, "التاريخ": "2026-01-01", "المبلغ": range(1, n + 1),
+                         "البيان": "", "رابط_السند": ""})
+
+
+def test_commit_import_assigns_id_blocks(tmp_path):
+    store = SQLiteStore(str(tmp_path / "shan.db"))
+    store.append("payments", payments(1).assign(PaymentID=4))
+    seen = []
+    saved = commit_import(store, "payments", payments(5), batch_rows=2, progress=seen.append)
+    assert saved['PaymentID'].tolist() == [5, 6, 7, 8, 9]
+    assert seen == [0.4, 0.8, 1.0]
+
+
+def test_commit_import_through_queue_waits_for_batches(tmp_path):
+    store = SQLiteStore(str(tmp_path / "shan.db"))
+    queue = WriteQueue(store, retry_seconds=0.01, batch_rows=2)
+    first = commit_import(queue, "payments", payments(3), batch_rows=2)
+    seen = []
+    second = commit_import(queue, "payments", payments(2), batch_rows=2, progress=seen.append)
+    # كتل متتالية لا تتداخل بين استيرادين، وكل دفعة وصلت للمصدر قبل تقدمها
+    assert first['PaymentID'].tolist() == [1, 2, 3] and second['PaymentID'].tolist() == [4, 5]
+    assert seen == [1.0]
+    assert store.load()[1]['PaymentID'].tolist() == [1, 2, 3, 4, 5]
@@ -0,0 +1,82 @@
+import pandas as pd
+import pytest
+from forecast import expand_obligations, bucket_obligations, MILESTONES
+
+TODAY = pd.Timestamp("2026-06-01")
+DATE_COLS = ["تاريخ_الاعتماد_الفعلي", "تاريخ_الشحن_المتوقع", "تاريخ_الشحن_الفعلي", "تاريخ_الوصول_المتوقع", "تاريخ_الوصول_الفعلي"]
+
+
+def orders(**overrides):
+    # طلبية معتمدة قبل شهر: الإجمالي 1000 (200 دولار × 3.75 + رسوم) بنسب 30/20/50
+    row = {"ID": 1, "الطلبية": "أ", "المورد": "م", "الحالة": "تم الاعتماد", "اجمالي_التكلفة": 1000.0,
+           "القيمة_دولار": 200.0, "سعر_الصرف": 3.75, "المدفوع": 0.0,
+           "نسبة_اعتماد": 30, "نسبة_شحن": 20, "نسبة_وصول": 50,
+           "تاريخ_الاعتماد_الفعلي": "2026-05-01", "تاريخ_الشحن_المتوقع": "2026-07-01", "تاريخ_الشحن_الفعلي": None,
+           "تاريخ_الوصول_المتوقع": "2026-08-01", "تاريخ_الوصول_الفعلي": None}
+    row.update(overrides)
+    df = pd.DataFrame([row])
+    for col in DATE_COLS:
+        df[col] = pd.to_datetime(df[col])
+    return df
+
+
+# (الوصف، تعديلات الطلبية، خيارات ماذا-لو، [(المرحلة، الاستحقاق، المبلغ، متأخرة)])
+CASES = [
+    ("unpaid", {}, {}, [
+        ("اعتماد", "2026-06-01", 300.0, True),
+        ("شحن", "2026-07-01", 200.0, False),
+        ("وصول", "2026-08-01", 500.0, False),
+    ]),
+    ("paid covers approval then part of shipping", {"المدفوع": 400.0}, {}, [
+        ("شحن", "2026-07-01", 100.0, False),
+        ("وصول", "2026-08-01", 500.0, False),
+    ]),
+    ("fully paid open order", {"المدفوع": 1000.0}, {}, []),
+    ("closed status", {"الحالة": "مسددة بالكامل"}, {}, []),
+    ("zero percentages due on arrival", {"نسبة_اعتماد": 0, "نسبة_شحن": 0, "نسبة_وصول": 0}, {}, [
+        ("وصول", "2026-08-01", 1000.0, False),
+    ]),
+    ("overdue arrival moved to today", {"تاريخ_الشحن_الفعلي": "2026-05-10", "تاريخ_الوصول_المتوقع": "2026-05-20", "المدفوع": 500.0}, {}, [
+        ("وصول", "2026-06-01", 500.0, True),
+    ]),
+    ("no dates: planned from today", {"الحالة": "لم يبدأ", "تاريخ_الاعتماد_الفعلي": None, "تاريخ_الشحن_المتوقع": None,
+                                      "تاريخ_الوصول_المتوقع": None}, {}, [
+        ("اعتماد", "2026-06-01", 300.0, False),
+        ("شحن", "2026-07-01", 200.0, False),
+        ("وصول", "2026-07-31", 500.0, False),
+    ]),
+    ("delay shifts expected dates only", {}, {"delay_days": 10}, [
+        ("اعتماد", "2026-06-01", 300.0, True),
+        ("شحن", "2026-07-11", 200.0, False),
+        ("وصول", "2026-08-11", 500.0, False),
+    ]),
+    ("exchange rate +2% on goods", {}, {"rate_shift": 0.02}, [
+        ("اعتماد", "2026-06-01", 304.5, True),
+        ("شحن", "2026-07-01", 203.0, False),
+        ("وصول", "2026-08-01", 507.5, False),
+    ]),
+]
+
+
+@pytest.mark.parametrize("overrides, options, expected", [c[1:] for c in CASES], ids=[c[0] for c in CASES])
+def test_expand_obligations(overrides, options, expected):
+    out = expand_obligations(orders(**overrides), TODAY, **options)
+    got = [(str(r["المرحلة"]), r["الاستحقاق"].strftime("%Y-%m-%d"), round(r["المبلغ"], 2), bool(r["متأخرة"]))
+           for r in out.to_dict("records")]
+    assert got == expected
+
+
+def test_bucket_obligations():
+    obligations = pd.DataFrame({
+        "المرحلة": pd.Categorical(["اعتماد", "شحن", "وصول", "وصول"], MILESTONES),
+        "الاستحقاق": pd.to_datetime(["2026-06-01", "2026-06-20", "2026-06-25", "2026-08-01"]),
+        "المبلغ": [300.0, 200.0, 500.0, 1000.0],
+    })
+    table = bucket_obligations(obligations, "M")
+    assert table["الفترة"].dt.strftime("%Y-%m").tolist() == ["2026-06", "2026-08"]
+    assert table[MILESTONES + ["الإجمالي", "التراكمي"]].values.tolist() == [
+        [300.0, 200.0, 500.0, 1000.0, 1000.0],
+        [0.0, 0.0, 1000.0, 1000.0, 2000.0],
+    ]
+    assert bucket_obligations(obligations, "M", horizon="2026-06-30")["الإجمالي"].tolist() == [1000.0]
+    assert bucket_obligations(obligations.iloc[0:0]).empty
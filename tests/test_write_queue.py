@@ -0,0 +1,211 @@
+import threading
+import time
+import pandas as pd
+import pytest
+from storage import SQLiteStore
+from write_queue import WriteQueue
+
+
+class CountingStore(SQLiteStore):
+    # يسجل استدعاءات المصدر، ويمكن إيقاف الكتابة مؤقتاً (gate) أو إفشالها عدداً من المرات (fail)
+    def __init__(self, path):
+        super().__init__(path)
+        self.calls = []
+        self.gate = None
+        self.fail = {}
+
+    def _call(self, name, *args):
+        self.calls.append((name,) + args)
+        if self.gate is not None:
+            self.gate.wait(5)
+        if self.fail.get(name, 0) > 0:
+            self.fail[name] -= 1
+            raise RuntimeError(f"{name} failed")
+
+    def next_id(self, table):
+        self.calls.append(("next_id", table))
+        return super().next_id(table)
+
+    def append(self, table, df):
+        self._call("append", table, len(df))
+        super().append(table, df)
+
+    def patch(self, table, changes, hints=None):
+        self._call("patch", table, changes)
+        return super().patch(table, changes, hints)
+
+
+def order(oid, name="طلبية", status="لم يبدأ"):
+    return pd.DataFrame([{"ID": oid, "الطلبية": name, "اجمالي_التكلفة": 100.0, "الحالة": status}])
+
+
+def payment(pid, oid, amount=10.0):
+    return pd.DataFrame([{"PaymentID": pid, "OrderID": oid, "التاريخ": "2026-01-01", "المبلغ": amount}])
+
+
+@pytest.fixture
+def store(tmp_path):
+    return CountingStore(str(tmp_path / "shan.db"))
+
+
+@pytest.fixture
+def queue(store):
+    return WriteQueue(store, retry_seconds=0.01)
+
+
+def ids(store, table="orders"):
+    key = "ID" if table == "orders" else "PaymentID"
+    with store._connect() as db:
+        return [r[0] for r in db.execute(f"SELECT {key} FROM {table} ORDER BY {key}")]
+
+
+def test_reserve_ids_reads_source_once(store, queue):
+    assert queue.reserve_ids("orders") == 1
+    assert queue.reserve_ids("orders", 3) == 2
+    assert queue.reserve_ids("orders") == 5
+    assert store.calls.count(("next_id", "orders")) == 1
+
+
+def test_reserve_ids_starts_after_source(store, queue):
+    store.append("orders", order(7))
+    assert queue.reserve_ids("orders") == 8
+
+
+def test_out_of_order_commit_is_not_renumbered(store, queue):
+    a, b = queue.reserve_ids("orders"), queue.reserve_ids("orders")
+    queue.append("orders", order(b, "B"), origin="b")
+    assert queue.flush(5)
+    queue.append("orders", order(a, "A"), origin="a")
+    assert queue.flush(5)
+    assert ids(store) == [1, 2]
+    assert queue.take_notices("a") == [] and queue.take_notices("b") == []
+
+
+def test_ids_taken_outside_queue_are_renumbered(store, queue):
+    oid = queue.reserve_ids("orders")
+    pid = queue.reserve_ids("payments")
+    store.append("orders", order(oid, "من خارج الطابور"))
+    queue.load()                                  # المزامنة في الخلفية ترى الرقم الذي كتبه غيرنا
+    queue.append("orders", order(oid, "A"), origin="a")
+    queue.append("payments", payment(pid, oid), origin="a")
+    queue.patch("orders", {oid: {"الحالة": "تم الاعتماد"}}, origin="a")
+    assert queue.flush(5)
+
+    assert ids(store) == [1, 2]
+    assert [n["kind"] for n in queue.take_notices("a")] == ["renumbered"]
+    with store._connect() as db:
+        assert db.execute("SELECT OrderID FROM payments").fetchall() == [(2,)]
+        statuses = dict(db.execute('SELECT ID, "الحالة" FROM orders').fetchall())
+    assert statuses == {1: "لم يبدأ", 2: "تم الاعتماد"}
+    # الحجز التالي بعد الأرقام المعاد ترقيمها
+    assert queue.reserve_ids("orders") == 3
+
+
+def test_unique_error_resyncs_and_renumbers(store, queue):
+    # رقم أخذ من خارج الطابور بعد آخر مزامنة: فشل قيد التفرد ثم إعادة المزامنة في المحاولة التالية
+    oid = queue.reserve_ids("orders")
+    store.append("orders", order(oid, "من خارج الطابور"))
+    queue.append("orders", order(oid, "A"), origin="a")
+    assert queue.flush(5)
+    assert ids(store) == [1, 2]
+    assert [n["kind"] for n in queue.take_notices("a")] == ["renumbered"]
+
+
+def test_ops_after_renumber_keep_their_ids(store, queue):
+    oid = queue.reserve_ids("orders")
+    store.append("orders", order(oid, "من خارج الطابور"))
+    queue.load()
+    queue.append("orders", order(oid, "A"), origin="a")
+    assert queue.flush(5)
+    queue.load()
+
+    # بعد إعادة التحميل: الرقم 1 لصف المستخدم الآخر، وصفنا 2
+    queue.patch("orders", {1: {"ملاحظات": "للصف 1"}}, origin="b")
+    queue.append("payments", payment(queue.reserve_ids("payments"), 1), origin="b")
+    assert queue.flush(5)
+    with store._connect() as db:
+        notes = dict(db.execute('SELECT ID, "ملاحظات" FROM orders').fetchall())
+        assert db.execute("SELECT OrderID FROM payments").fetchall() == [(1,)]
+    assert notes == {1: "للصف 1", 2: None}
+
+    queue.delete("orders", [1], origin="b")
+    assert queue.flush(5)
+    assert ids(store) == [2]
+
+
+def test_appends_are_not_merged_past_batch_rows(store):
+    queue = WriteQueue(store, retry_seconds=0.01, batch_rows=2)
+    store.gate = threading.Event()
+    queue.append("orders", order(1), origin="a")             # يشغل الخيط حتى يفتح gate
+    while ("append", "orders", 1) not in store.calls:
+        time.sleep(0.001)
+    ops = [queue.append("orders", order(i), origin="a") for i in range(2, 7)]
+    store.gate.set()
+    assert all(queue.wait(op, 5) for op in ops)
+    assert [c for c in store.calls if c[0] == "append"] == [("append", "orders", n) for n in (1, 2, 2, 1)]
+    assert ids(store) == [1, 2, 3, 4, 5, 6]
+
+
+def test_wait_reports_final_failure(store):
+    queue = WriteQueue(store, max_attempts=2, retry_seconds=0.01)
+    store.fail["append"] = 5
+    assert not queue.wait(queue.append("orders", order(1), origin="a"), 5)
+
+
+def test_ops_queued_while_busy_are_coalesced(store, queue):
+    store.append("orders", order(1))
+    store.calls.clear()
+    store.gate = threading.Event()
+    queue.append("payments", payment(1, 1), origin="a")      # يشغل الخيط حتى يفتح gate
+    while ("append", "payments", 1) not in store.calls:
+        time.sleep(0.001)
+    queue.append("orders", order(2), origin="a")
+    queue.append("orders", order(3), origin="b")
+    queue.patch("orders", {1: {"الحالة": "تم الاعتماد"}}, origin="a")
+    queue.patch("orders", {1: {"ملاحظات": "ملاحظة"}}, origin="b")
+    store.calls.clear()
+    store.gate.set()
+    assert queue.flush(5)
+
+    writes = [c for c in store.calls if c[0] in ("append", "patch")]
+    assert writes == [("append", "orders", 2), ("patch", "orders", {1: {"الحالة": "تم الاعتماد", "ملاحظات": "ملاحظة"}})]
+
+
+def test_retry_does_not_repeat_appends(store, queue):
+    store.append("orders", order(1))
+    store.fail["patch"] = 2
+    queue.append("orders", order(2), origin="a")
+    queue.patch("orders", {1: {"الحالة": "تم الشحن"}}, origin="a")
+    assert queue.flush(5)
+
+    assert [c for c in store.calls if c[0] == "append"] == [("append", "orders", 1), ("append", "orders", 1)]
+    assert ids(store) == [1, 2]
+    assert store.read_cells("orders", [1], ["الحالة"]) == {1: {"الحالة": "تم الشحن"}}
+    assert queue.take_notices("a") == []
+
+
+def test_failure_after_max_attempts_notifies_origin(store):
+    queue = WriteQueue(store, max_attempts=2, retry_seconds=0.01)
+    store.fail["append"] = 5
+    queue.append("orders", order(1), origin="a")
+    assert queue.flush(5)
+    assert [n["kind"] for n in queue.take_notices("a")] == ["failed"]
+    assert ids(store) == []
+
+
+def test_conflicting_patch_is_skipped_and_notified(store, queue):
+    store.append("orders", order(1, status="تم الشحن"))
+    queue.patch("orders", {1: {"الحالة": "تخليص جمركي"}}, expected={1: {"الحالة": "تم الاعتماد"}}, origin="a")
+    assert queue.flush(5)
+
+    notices = queue.take_notices("a")
+    assert [n["kind"] for n in notices] == ["conflict"]
+    assert "تم الاعتماد" in notices[0]["message"]
+    assert queue.take_notices("a") == []
+    assert store.read_cells("orders", [1], ["الحالة"]) == {1: {"الحالة": "تم الشحن"}}
+
+
+def test_conflict_on_deleted_row(store, queue):
+    queue.patch("orders", {9: {"الحالة": "تم الشحن"}}, expected={9: {"الحالة": "لم يبدأ"}}, origin="a")
+    assert queue.flush(5)
+    assert "حذف" in queue.take_notices("a")[0]["message"]
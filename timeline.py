@@ -0,0 +1,86 @@
+import pandas as pd
+from datetime import timedelta
+
+# --- بناء بيانات الجدول الزمني (Gantt) بعمليات على الأعمدة لكل الطلبات مرة واحدة ---
+DONE_STATUSES = ["وصلت للمستودع", "مسددة بالكامل"]
+TRANSIT_STATUSES = ["تم الشحن", "تخليص جمركي"]
+GANTT_COLS = ["ID", "Task", "Supplier", "Status", "Start", "Finish", "Stage", "Color"]
+DAYS_30 = timedelta(days=30)
+DAYS_60 = timedelta(days=60)
+
+
+def build_timeline(df_orders, today):
+    if df_orders.empty:
+        return pd.DataFrame(columns=GANTT_COLS)
+    today = pd.Timestamp(today)
+    status = df_orders['الحالة']
+    conf = df_orders['تاريخ_الاعتماد_الفعلي']
+    arrive_exp = df_orders['تاريخ_الوصول_المتوقع']
+    base = pd.DataFrame({
+        "ID": df_orders['ID'], "Task": df_orders['الطلبية'],
+        "Supplier": df_orders['المورد'], "Status": status,
+    })
+
+    def phase(mask, start, finish, stage, color):
+        part = base[mask].copy()
+        part['Start'] = start[mask]
+        part['Finish'] = finish[mask]
+        part['Stage'] = stage if isinstance(stage, str) else stage[mask]
+        part['Color'] = color if isinstance(color, str) else color[mask]
+        return part
+
+    # 1. لم يبدأ: 60 يوم قبل الوصول المتوقع
+    planned = status == "لم يبدأ"
+    plan_end = arrive_exp.fillna(today + DAYS_60)
+
+    # 2. مكتملة: من الاعتماد إلى الوصول الفعلي
+    done = status.isin(DONE_STATUSES)
+
+    # 3. الجارية: تجهيز حتى الشحن، ثم شحن/جمارك حتى الوصول
+    active = ~planned & ~done
+    start_conf = conf.fillna(today)
+    phase1_end = df_orders['تاريخ_الشحن_الفعلي'].fillna(df_orders['تاريخ_الشحن_المتوقع']).fillna(start_conf + DAYS_30)
+    transit = active & status.isin(TRANSIT_STATUSES)
+    phase2_end = arrive_exp.fillna(phase1_end + DAYS_30)
+    customs = status == "تخليص جمركي"
+    transit_stage = customs.map({True: "جمارك", False: "شحن (30 يوم)"})
+    transit_color = customs.map({True: "#e74c3c", False: "#e67e22"})
+
+    parts = [
+        phase(planned, plan_end - DAYS_60, plan_end, "مخطط (60 يوم)", "#95a5a6"),
+        phase(done, start_conf, df_orders['تاريخ_الوصول_الفعلي'].fillna(today), "مكتملة", "#27ae60"),
+        phase(active, start_conf, phase1_end, "تجهيز (30 يوم)", "#3498db"),
+        phase(transit, phase1_end, phase2_end, transit_stage, transit_color),
+    ]
+    # الحفاظ على ترتيب الطلبات كما في السجل (المرحلة الأولى قبل الثانية لكل طلبية)
+    for rank, part in enumerate(parts): part['_rank'] = rank
+    df_gantt = pd.concat(parts)
+    df_gantt['_pos'] = df_gantt.index
+    df_gantt = df_gantt.sort_values(['_pos', '_rank'], kind="stable").drop(columns=['_pos', '_rank'])
+    return df_gantt.reset_index(drop=True)[GANTT_COLS]
+
+
+def window_timeline(df_gantt, start=None, end=None, statuses=None, page=0, page_size=None):
+    # نافذة محدودة: نطاق تاريخ + حالات + صفحة من الطلبات
+    # ترجع (الصفوف المعروضة، عدد الطلبات المطابقة)
+    mask = pd.Series(True, index=df_gantt.index)
+    if start is not None: mask &= df_gantt['Finish'] >= pd.Timestamp(start)
+    if end is not None: mask &= df_gantt['Start'] <= pd.Timestamp(end)
+    if statuses: mask &= df_gantt['Status'].isin(statuses)
+    df_win = df_gantt[mask]
+    ids = df_win['ID'].drop_duplicates()
+    if not page_size:
+        return df_win, len(ids)
+    page_ids = ids.iloc[page * page_size:(page + 1) * page_size]
+    return df_win[df_win['ID'].isin(page_ids)], len(ids)
+
+
+def aggregate_by_supplier(df_gantt):
+    # صف لكل مورد ومرحلة: من أول بداية إلى آخر نهاية
+    if df_gantt.empty:
+        return df_gantt
+    agg = df_gantt.assign(Supplier=df_gantt['Supplier'].astype(object).fillna("بدون مورد")).groupby(
+        ['Supplier', 'Stage', 'Color'], sort=False
+    ).agg(Start=('Start', 'min'), Finish=('Finish', 'max')).reset_index()
+    agg['Task'] = agg['Supplier']
+    return agg
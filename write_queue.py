@@ -0,0 +1,313 @@
+import logging
+import threading
+import time
+from collections import deque
+import pandas as pd
+from bulk_import import BATCH_ROWS
+from sheets import _cell
+
+# --- طابور كتابة في الخلفية (write-behind) للحفظ من عدة مستخدمين ---
+# الواجهة تضيف العملية للطابور وتعود فوراً؛ خيط واحد يدمج العمليات المتتالية ويكتبها للمصدر.
+# التعديل يحمل القيم التي رآها المستخدم قبل التعديل (expected)، فإن تغيرت في المصدر من مستخدم آخر
+# لا نكتب فوقها ونسجلها كتعارض يظهر لصاحب التعديل.
+
+log = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = 5
+RETRY_SECONDS = 0.5          # يتضاعف مع كل محاولة
+WAIT_SECONDS = 60            # أقصى انتظار لكتابة عملية واحدة (wait)
+KEYS = {"orders": "ID", "payments": "PaymentID"}
+
+
+class WriteQueue:
+    def __init__(self, store, max_attempts=MAX_ATTEMPTS, retry_seconds=RETRY_SECONDS, batch_rows=BATCH_ROWS):
+        self.store = store
+        self._max_attempts = max_attempts
+        self._retry_seconds = retry_seconds
+        self._batch_rows = batch_rows            # أقصى صفوف في طلب إضافة واحد بعد الدمج
+        self._lock = threading.Lock()
+        self._wake = threading.Condition(self._lock)
+        self._ops = deque()
+        self._busy = False
+        self._next = {}                          # آخر ID محجوز لكل جدول
+        self._outside = {}                       # أعلى رقم في المصدر كتبه غير هذا الطابور (من آخر مزامنة)
+        self._written = {table: set() for table in KEYS}
+        self._generation = 0                     # عدد مرات التحميل: كل عملية تحمل رقم البيانات التي بنيت عليها
+        self._renumbered = []                    # [(generation, table, {الرقم القديم: الجديد})]
+        self._notices = {}                       # origin -> [{kind, message}]
+        threading.Thread(target=self._run, daemon=True).start()
+
+    # --- حجز الأرقام: من هذا الطابور فقط حتى لا يأخذ مستخدمان نفس الرقم ---
+    # أول رقم يقرأ من المصدر مرة لكل جدول ثم يحدث في الخلفية (بعد كل تحميل أو إعادة ترقيم)،
+    # ومن نفس المزامنة نعرف إن كتب أحد من خارج الطابور أرقاماً بعد أرقام حجزناها ولم تكتب بعد
+    def reserve_ids(self, table, n=1):
+        with self._lock:
+            known = table in self._next
+        stored = 0 if known else self.store.next_id(table)
+        with self._lock:
+            first = max(stored, self._next.get(table, 0))
+            self._next[table] = first + n
+            return first
+
+    def _sync_next(self, tables):
+        for table in tables:
+            stored = self.store.next_id(table)
+            with self._lock:
+                self._next[table] = max(stored, self._next.get(table, 0))
+                if stored - 1 not in self._written[table]:
+                    self._outside[table] = stored - 1
+
+    # --- العمليات (تعود فوراً) ---
+    def append(self, table, df, origin=None):
+        # ترجع العملية نفسها لمن يريد انتظار كتابتها (wait)
+        if df.empty: return None
+        return self._put({"op": "append", "table": table, "rows": df.copy(), "origin": origin})
+
+    def patch(self, table, changes, expected=None, hints=None, origin=None):
+        # changes: {المفتاح: {العمود: القيمة}}، expected: {المفتاح: {العمود: القيمة قبل التعديل}}
+        if not changes: return
+        self._put({"op": "patch", "table": table, "changes": changes, "expected": expected or {},
+                   "hints": hints or {}, "origin": origin})
+
+    def delete(self, table, ids, hints=None, origin=None):
+        if not ids: return
+        self._put({"op": "delete", "table": table, "ids": list(ids), "hints": hints or {}, "origin": origin})
+
+    def _put(self, op):
+        op["attempt"] = 0
+        op["written"] = threading.Event()
+        with self._wake:
+            op["generation"] = self._generation
+            self._ops.append(op)
+            self._wake.notify()
+        return op
+
+    def wait(self, op, timeout=WAIT_SECONDS):
+        # انتظار كتابة عملية واحدة: True إن وصلت للمصدر (False عند الفشل النهائي أو انتهاء المهلة)
+        return op["written"].wait(timeout) and not op.get("failed")
+
+    # --- الحالة للواجهة ---
+    def pending(self):
+        with self._lock:
+            return len(self._ops) + (1 if self._busy else 0)
+
+    def take_notices(self, origin):
+        # التعارضات والأخطاء الخاصة بهذا المستخدم (تظهر مرة واحدة)
+        with self._lock:
+            return self._notices.pop(origin, [])
+
+    def flush(self, timeout=None):
+        # انتظار وصول كل العمليات المعلقة للمصدر
+        deadline = None if timeout is None else time.time() + timeout
+        with self._wake:
+            while self._ops or self._busy:
+                left = None if deadline is None else deadline - time.time()
+                if left is not None and left <= 0: return False
+                self._wake.wait(left)
+        return True
+
+    def load(self):
+        # قراءة المصدر بعد الكتابات المعلقة حتى لا تعود نسخة أقدم من الحفظ المعروض
+        self.flush(timeout=60)
+        frames = self.store.load()
+        with self._lock:
+            self._generation += 1
+            tables = list(self._next)
+        self._sync_next(tables)
+        return frames
+
+    # --- خيط الكتابة ---
+    def _run(self):
+        while True:
+            with self._wake:
+                while not self._ops:
+                    self._wake.wait()
+                batch = list(self._ops)
+                self._ops.clear()
+                self._busy = True
+            try:
+                self._commit(batch)
+            except Exception as e:
+                self._retry(batch, e)
+            finally:
+                with self._wake:
+                    self._busy = False
+                    self._wake.notify_all()
+
+    def _retry(self, batch, error):
+        attempt = max(op["attempt"] for op in batch) + 1
+        if attempt >= self._max_attempts:
+            log.warning("write failed after %s attempts: %s", attempt, error)
+            for origin in {op["origin"] for op in batch}:
+                self._notify(origin, "failed", f"تعذر الحفظ بعد {attempt} محاولات: {error}")
+            for op in batch:
+                if not op.get("done"):
+                    op["failed"] = True
+                    op["written"].set()
+            self._reload()
+            return
+        log.info("write failed (attempt %s), retrying: %s", attempt, error)
+        time.sleep(self._retry_seconds * 2 ** (attempt - 1))
+        # قد يكون الخطأ رقماً أخذه أحد من خارج الطابور بعد آخر مزامنة (قيد التفرد في SQLite): نعيد المزامنة قبل المحاولة
+        self._sync_next({op["table"] for op in batch if op["op"] == "append" and not op.get("done")})
+        with self._wake:
+            # ما كتب قبل الخطأ لا يعاد (حتى لا تتكرر الإضافات)
+            for op in reversed([op for op in batch if not op.get("done")]):
+                op["attempt"] = attempt
+                self._ops.appendleft(op)
+
+    def _commit(self, batch):
+        # الإضافات أولاً: الطلبات قبل الدفعات لأنها قد يعاد ترقيمها فتتبعها دفعاتها وتعديلاتها،
+        # وتدمج الإضافات المتتالية لكل جدول حتى batch_rows صف في الطلب (وكل طلب يكتمل وحده عند إعادة المحاولة)
+        with self._lock:
+            oldest = min(op["generation"] for op in batch)
+            self._renumbered = [r for r in self._renumbered if r[0] >= oldest]
+        for table in ("orders", "payments"):
+            self._remap(batch)
+            ops = [op for op in batch if op["op"] == "append" and op["table"] == table and not op.get("done")]
+            for chunk in self._chunks(ops):
+                self._append(table, chunk)
+                _done(chunk)
+
+        # ثم التعديلات لكل صف في تعديل واحد، ثم الحذف
+        self._remap(batch)
+        patches, deletes = {}, {}
+        for op in batch:
+            table = op["table"]
+            if op.get("done") or op["op"] == "append": continue
+            if op["op"] == "patch":
+                merged = patches.setdefault(table, {"changes": {}, "expected": {}, "hints": {}, "origins": {}, "ops": []})
+                merged["ops"].append(op)
+                for oid, row in op["changes"].items():
+                    merged["changes"].setdefault(oid, {}).update(row)
+                    merged["origins"].setdefault(oid, set()).add(op["origin"])
+                    # التوقع الأول هو ما في المصدر؛ التعديلات اللاحقة مبنية على قيمنا نحن
+                    for col, value in op["expected"].get(oid, {}).items():
+                        merged["expected"].setdefault(oid, {}).setdefault(col, value)
+                merged["hints"].update(op["hints"])
+            else:
+                merged = deletes.setdefault(table, {"ids": [], "hints": {}, "ops": []})
+                merged["ops"].append(op)
+                merged["ids"] += op["ids"]
+                merged["hints"].update(op["hints"])
+        for table, merged in patches.items():
+            self._patch(table, merged)
+            _done(merged["ops"])
+        for table, merged in deletes.items():
+            self.store.delete(table, merged["ids"], hints=merged["hints"])
+            _done(merged["ops"])
+
+    def _chunks(self, ops):
+        chunk, size = [], 0
+        for op in ops:
+            if chunk and size + len(op["rows"]) > self._batch_rows:
+                yield chunk
+                chunk, size = [], 0
+            chunk.append(op)
+            size += len(op["rows"])
+        if chunk:
+            yield chunk
+
+    def _append(self, table, ops):
+        key = KEYS[table]
+        rows = pd.concat([op["rows"] for op in ops], ignore_index=True)
+        # أرقام حجزناها قبل أن يكتب أحد من خارج الطابور أرقاماً بعدها (من آخر مزامنة): نعيد ترقيم صفوفنا بعد آخر رقم
+        with self._lock:
+            outside = self._outside.get(table, 0)
+        if rows[key].min() <= outside:
+            stored = self.store.next_id(table)
+            with self._lock:
+                current = max(stored, self._next.get(table, 0))
+                self._next[table] = current + len(rows)
+                mapping = dict(zip(rows[key].tolist(), range(current, current + len(rows))))
+                self._renumbered.append((self._generation, table, mapping))
+            rows[key] = rows[key].map(mapping)
+            for op in ops:
+                op["rows"] = op["rows"].assign(**{key: op["rows"][key].map(mapping)})
+            for origin in {op["origin"] for op in ops}:
+                self._notify(origin, "renumbered", f"أعيد ترقيم صفوف جديدة في {table} لأن أرقامها استخدمت من مستخدم آخر")
+            self._reload()
+        self.store.append(table, rows)
+        with self._lock:
+            self._written[table].update(rows[key].tolist())
+
+    def _remap(self, batch):
+        # العمليات المبنية على بيانات ما قبل إعادة الترقيم (نفس رقم التحميل أو أقدم) تشير لصفوفنا بأرقامها القديمة؛
+        # ما بني على تحميل لاحق لا يمس: الرقم القديم فيه صار لصف المستخدم الآخر.
+        # الأرقام الجديدة بعد كل المحجوز فتطبيق الخريطة مرة ثانية (عند إعادة المحاولة) لا يغير شيئاً
+        with self._lock:
+            renumbered = list(self._renumbered)
+        for generation, table, mapping in renumbered:
+            new = lambda i: mapping.get(i, i)
+            for op in batch:
+                if op.get("done") or op["generation"] > generation: continue
+                if op["table"] == table and op["op"] == "patch":
+                    for name in ("changes", "expected", "hints"):
+                        op[name] = {new(i): v for i, v in op[name].items()}
+                elif op["table"] == table and op["op"] == "delete":
+                    op["ids"] = [new(i) for i in op["ids"]]
+                    op["hints"] = {new(i): v for i, v in op["hints"].items()}
+                elif table == "orders" and op["table"] == "payments" and op["op"] == "append":
+                    op["rows"] = op["rows"].assign(OrderID=op["rows"]['OrderID'].map(new))
+
+    def _patch(self, table, merged):
+        changes, expected, origins = dict(merged["changes"]), merged["expected"], merged["origins"]
+
+        # التحقق قبل الكتابة: القيم الحالية في المصدر للخلايا التي رآها المستخدم
+        conflicts = []
+        if expected:
+            cols = sorted({c for row in expected.values() for c in row})
+            current = self.store.read_cells(table, list(expected), cols, hints=merged["hints"])
+            for oid, row in expected.items():
+                if oid not in current:
+                    conflicts.append((oid, "الصف حذف من مستخدم آخر"))
+                    continue
+                changed = [c for c, value in row.items() if not same_value(value, current[oid].get(c))]
+                if changed:
+                    conflicts.append((oid, "، ".join(f"{c}: {_cell(row[c])} ← {current[oid].get(c)}" for c in changed)))
+        for oid, message in conflicts:
+            changes.pop(oid, None)
+            for origin in origins.get(oid, ()):
+                self._notify(origin, "conflict", f"لم يحفظ تعديل {table} #{oid} لأنه تغير من مستخدم آخر ({message})")
+        if conflicts:
+            self._reload()
+
+        missing = self.store.patch(table, changes, hints=merged["hints"])
+        for oid in missing or []:
+            for origin in origins.get(oid, ()):
+                self._notify(origin, "conflict", f"لم يحفظ تعديل {table} #{oid}: الصف غير موجود")
+
+    def _notify(self, origin, kind, message):
+        with self._lock:
+            self._notices.setdefault(origin, []).append({"kind": kind, "message": message})
+
+    def _reload(self):
+        # الكاش يعرض نتيجة متفائلة لم تكتب كما هي: نعيد القراءة من المصدر
+        if self.store.cache is not None:
+            self.store.cache.invalidate()
+
+
+def same_value(expected, actual):
+    # مقارنة قيمة من الإطار بقيمة من المصدر (الورقة ترجع نصوصاً منسقة)
+    a, b = _cell(expected), _cell(actual)
+    a = "" if a is None else str(a).strip()
+    b = "" if b is None else str(b).strip()
+    if a == b: return True
+    na, nb = _number(a), _number(b)
+    if na is not None and nb is not None: return abs(na - nb) < 1e-6
+    # خلية رقمية فارغة في الورقة تقرأ 0
+    if a == "": return nb == 0
+    if b == "": return na == 0
+    da, db = pd.to_datetime(a, errors='coerce'), pd.to_datetime(b, errors='coerce')
+    return not pd.isna(da) and da == db
+
+
+def _done(ops):
+    for op in ops:
+        op["done"] = True
+        op["written"].set()
+
+
+def _number(text):
+    value = pd.to_numeric(text.replace(",", ""), errors='coerce') if text else None
+    return None if value is None or pd.isna(value) else float(value)